@@ -0,0 +1,168 @@
+"""
+Collage Benchmark
+Measures time and peak memory of create_image_collage with and without reduced-resolution decoding.
+
+Usage:
+    python benchmark_collage.py image1.jpg image2.jpg ... [--cell-size 1500] [--cols 3] [--runs 3]
+"""
+
+import sys
+import time
+import queue
+import argparse
+import tempfile
+import multiprocessing
+from pathlib import Path
+
+import image_processor
+
+
+# Seconds a single collage may take before its run is considered hung
+RUN_TIMEOUT_SECONDS = 600
+
+
+def _peak_memory_mb():
+    """
+    Get the peak resident memory of the current process.
+
+    Returns:
+        float: Peak memory in MB
+    """
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb
+        )
+        return counters.PeakWorkingSetSize / (1024 * 1024)
+
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _run_collage(image_paths, cell_size, cols, fast_decode, result_queue):
+    """
+    Build one collage and report its duration and the process peak memory.
+    Runs in a fresh process so the peak memory of one mode does not leak into the other.
+    """
+    rows = (len(image_paths) + cols - 1) // cols
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_path = str(Path(temp_dir) / "collage.jpg")
+        start = time.perf_counter()
+        image_processor.create_image_collage(
+            image_paths, output_path, rows, cols, image_size=(cell_size, cell_size), fast_decode=fast_decode
+        )
+        elapsed = time.perf_counter() - start
+    result_queue.put((elapsed, _peak_memory_mb()))
+
+
+def _wait_for_result(process, result_queue, timeout):
+    """
+    Wait for the result of a collage process, without hanging if it died or got stuck.
+
+    Args:
+        process (multiprocessing.Process): The running collage process
+        result_queue (multiprocessing.Queue): Queue the process puts its result in
+        timeout (float): Maximum seconds to wait
+
+    Returns:
+        tuple: (elapsed seconds, peak memory in MB)
+
+    Raises:
+        RuntimeError: If the process exited without a result (bad path, decode error, out of memory...)
+        TimeoutError: If the process did not finish in time; it is terminated
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return result_queue.get(timeout=1)
+        except queue.Empty:
+            pass
+        if not process.is_alive():
+            # The result may have been put right before the process exited
+            try:
+                return result_queue.get(timeout=1)
+            except queue.Empty:
+                raise RuntimeError(f"Collage process exited with code {process.exitcode} without a result")
+        if time.monotonic() >= deadline:
+            process.terminate()
+            process.join()
+            raise TimeoutError(f"Collage process did not finish in {timeout:.0f}s")
+
+
+def benchmark(image_paths, cell_size=1500, cols=3, runs=3, timeout=RUN_TIMEOUT_SECONDS):
+    """
+    Benchmark the collage creation in both decoding modes.
+
+    Args:
+        image_paths (list): Images to put in the collage
+        cell_size (int, optional): Size of each collage cell. Defaults to 1500
+        cols (int, optional): Number of collage columns. Defaults to 3
+        runs (int, optional): Number of runs per mode. Defaults to 3
+        timeout (float, optional): Maximum seconds per run. Defaults to RUN_TIMEOUT_SECONDS
+
+    Returns:
+        dict: Mapping "full_decode"/"fast_decode" to (best time in seconds, peak memory in MB)
+
+    Raises:
+        RuntimeError: If a run crashed
+        TimeoutError: If a run took longer than timeout
+    """
+    results = {}
+    for label, fast_decode in (("full_decode", False), ("fast_decode", True)):
+        timings = []
+        peaks = []
+        for _ in range(runs):
+            result_queue = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=_run_collage, args=(image_paths, cell_size, cols, fast_decode, result_queue)
+            )
+            process.start()
+            elapsed, peak = _wait_for_result(process, result_queue, timeout)
+            process.join()
+            timings.append(elapsed)
+            peaks.append(peak)
+        results[label] = (min(timings), max(peaks))
+    return results
+
+
+def main():
+    """Parse the command line and print the benchmark results."""
+    parser = argparse.ArgumentParser(description="Benchmark create_image_collage decoding modes.")
+    parser.add_argument("images", nargs="+", help="Images to put in the collage")
+    parser.add_argument("--cell-size", type=int, default=1500, help="Size of each collage cell in pixels")
+    parser.add_argument("--cols", type=int, default=3, help="Number of collage columns")
+    parser.add_argument("--runs", type=int, default=3, help="Number of runs per mode")
+    parser.add_argument("--timeout", type=float, default=RUN_TIMEOUT_SECONDS, help="Maximum seconds per run")
+    args = parser.parse_args()
+
+    results = benchmark(args.images, args.cell_size, args.cols, args.runs, args.timeout)
+
+    print(f"\n{len(args.images)} images, {args.cell_size}px cells, best of {args.runs} runs")
+    print(f"{'mode':<14}{'time (s)':>10}{'peak (MB)':>12}")
+    for label, (elapsed, peak) in results.items():
+        print(f"{label:<14}{elapsed:>10.3f}{peak:>12.1f}")
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
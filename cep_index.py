@@ -0,0 +1,166 @@
+"""
+CEP Index Module
+Compiles a CEP -> street dataset into a compact sorted binary file and looks CEPs up in it offline,
+using a memory-mapped binary search.
+
+File layout (little endian):
+    header:  magic (8 bytes) | record count (uint32)
+    records: cep as integer (uint32) | street offset (uint32) | street length (uint16), sorted by cep
+    streets: UTF-8 street names, concatenated
+
+Usage (builder):
+    python cep_index.py dados_pe.csv cep_index.bin [--cep-column cep] [--street-column logradouro]
+"""
+
+import os
+import re
+import csv
+import mmap
+import struct
+import argparse
+from pathlib import Path
+
+
+# Default location of the index, loaded by data_extractor when it exists
+CEP_INDEX_PATH = Path.home() / ".auto_preenchedor_data" / "cep_index.bin"
+
+MAGIC = b"CEPIDX1\0"
+HEADER = struct.Struct("<8sI")
+RECORD = struct.Struct("<IIH")
+
+
+def build_cep_index(csv_path, output_path=CEP_INDEX_PATH, cep_column="cep", street_column="logradouro",
+                    encoding="utf-8"):
+    """
+    Compile a CSV with CEPs and streets into a binary index.
+
+    Args:
+        csv_path (str): Path to the CSV file. The delimiter (comma or semicolon) is detected
+        output_path (str, optional): Path where the index should be saved. Defaults to CEP_INDEX_PATH
+        cep_column (str, optional): Name of the CEP column. Defaults to "cep"
+        street_column (str, optional): Name of the street column. Defaults to "logradouro"
+        encoding (str, optional): Encoding of the CSV file. Defaults to "utf-8"
+
+    Returns:
+        int: Number of CEPs in the index
+    """
+    streets_by_cep = {}
+    with open(csv_path, "r", encoding=encoding, newline="") as f:
+        dialect = csv.Sniffer().sniff(f.read(64 * 1024), delimiters=",;\t")
+        f.seek(0)
+        for row in csv.DictReader(f, dialect=dialect):
+            cep = re.sub(r"\D", "", row.get(cep_column) or "")
+            street = (row.get(street_column) or "").strip()
+            if len(cep) == 8 and street:
+                streets_by_cep[int(cep)] = street
+
+    records = bytearray()
+    streets = bytearray()
+    for cep in sorted(streets_by_cep):
+        street_bytes = streets_by_cep[cep].encode("utf-8")[:0xFFFF]
+        records += RECORD.pack(cep, len(streets), len(street_bytes))
+        streets += street_bytes
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    # Written aside and swapped in at once, so a running program never maps a half-written index
+    temp_path = output_path.with_suffix(f"{output_path.suffix}.{os.getpid()}.tmp")
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(streets_by_cep)))
+            f.write(records)
+            f.write(streets)
+        os.replace(temp_path, output_path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+    print(f"CEP index with {len(streets_by_cep)} CEPs saved to {output_path}")
+    return len(streets_by_cep)
+
+
+class CepIndex:
+    """
+    Read-only view of a CEP index file. The file is memory-mapped, so opening it costs nothing
+    and only the pages touched by the binary search are read from disk.
+    """
+
+    def __init__(self, index_path=CEP_INDEX_PATH):
+        """
+        Open an index file.
+
+        Args:
+            index_path (str, optional): Path to the index. Defaults to CEP_INDEX_PATH
+
+        Raises:
+            ValueError: If the file is not a CEP index, or is truncated
+        """
+        self._file = open(index_path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            self._file.close()
+            raise ValueError(f"{index_path} is not a CEP index file")
+
+        if len(self._map) < HEADER.size:
+            self.close()
+            raise ValueError(f"{index_path} is not a CEP index file")
+        magic, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{index_path} is not a CEP index file")
+        self._streets_offset = HEADER.size + self.count * RECORD.size
+        if len(self._map) < self._streets_offset:
+            self.close()
+            raise ValueError(f"{index_path} is truncated: {self.count} records announced")
+
+    def get_street(self, cep):
+        """
+        Look up the street of a CEP.
+
+        Args:
+            cep (str): CEP, with or without punctuation
+
+        Returns:
+            str: The street, or None if the CEP is not in the index
+        """
+        digits = re.sub(r"\D", "", cep or "")
+        if len(digits) != 8:
+            return None
+        target = int(digits)
+
+        low, high = 0, self.count - 1
+        while low <= high:
+            middle = (low + high) // 2
+            record_cep, street_offset, street_length = RECORD.unpack_from(self._map, HEADER.size + middle * RECORD.size)
+            if record_cep < target:
+                low = middle + 1
+            elif record_cep > target:
+                high = middle - 1
+            else:
+                start = self._streets_offset + street_offset
+                return self._map[start:start + street_length].decode("utf-8")
+        return None
+
+    def close(self):
+        """Release the memory map and the file."""
+        self._map.close()
+        self._file.close()
+
+
+def main():
+    """Build a CEP index from the command line."""
+    parser = argparse.ArgumentParser(description="Compile a CEP -> street CSV into a binary index.")
+    parser.add_argument("csv_path", help="CSV file with the CEPs and streets")
+    parser.add_argument("output_path", nargs="?", default=str(CEP_INDEX_PATH), help="Where to save the index")
+    parser.add_argument("--cep-column", default="cep", help="Name of the CEP column")
+    parser.add_argument("--street-column", default="logradouro", help="Name of the street column")
+    parser.add_argument("--encoding", default="utf-8", help="Encoding of the CSV file")
+    args = parser.parse_args()
+
+    build_cep_index(args.csv_path, args.output_path, args.cep_column, args.street_column, args.encoding)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,877 @@
 """
 Data Extraction Module
-Handles AI-based text extraction from images and data parsing using Google's Generative AI.
+Handles AI-based text extraction from images and data parsing using Google's Generative AI,
+with an optional local OCR engine (Tesseract).
 """
 
 import os
 import ast
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from brazilcep import get_address_from_cep
+from brazilcep import get_address_from_cep, exceptions as brazilcep_exceptions
 from dotenv import load_dotenv
-from PIL import Image
+from PIL import Image, ImageOps
 import google.generativeai as genai
+from cep_index import CepIndex, CEP_INDEX_PATH
+from local_extractor import extract_fields_locally, find_ceps_in_text, find_cids_in_text, validate_extracted_data
+from request_policy import RequestPolicy
+from rate_limiter import TokenBucket, AIMDController
+
+try:
+    import pytesseract
+except ImportError:  # Optional, only needed for the local OCR engine
+    pytesseract = None
 
 # Load environment variables from user's .auto_preenchedor_data folder
 env_path = Path.home() / ".auto_preenchedor_data" / ".env"
 if env_path.exists():
     load_dotenv(env_path)
 
+# Model used for both the text extraction and the data parsing
+DEFAULT_MODEL_NAME = "gemini-2.5-pro"
+
+# Faster model tried first by the tiered extraction, escalating to DEFAULT_MODEL_NAME when its result fails validation
+FAST_MODEL_NAME = "gemini-2.5-flash"
+
+# Prompt used to read the text of a document image
+IMAGE_TEXT_PROMPT = "Extract all the text in this image and provide it as plain text."
+
+# Maximum number of documents read at the same time in the per-document mode
+MAX_CONCURRENT_OCR_REQUESTS = 4
+
+# Fields that must be found for a local OCR result to be accepted without asking the cloud model
+REQUIRED_FIELDS = [
+    "nome_do_responsavel",
+    "nome_do_menor",
+    "cpf_do_menor",
+    "data_de_nascimento_do_menor",
+]
+
+# Fields extracted from the documents
+DATA_FIELDS = [
+    "nome_do_responsavel",
+    "nome_do_menor",
+    "nome_da_mae_do_menor",
+    "cpf_do_responsavel",
+    "rg_do_responsavel",
+    "cpf_do_menor",
+    "rg_do_menor",
+    "data_de_nascimento_do_menor",
+    "endereço",
+    "cep",
+    "cids",
+]
+
+# Example of the expected values, with the rules for each field
+FIELDS_DESCRIPTION = """
+    User Information:
+    nome_do_responsavel: maria
+    nome_do_menor: joao
+    nome_da_mae_do_menor: ana silva
+    cpf_do_responsavel: 123.456.789-00
+    rg_do_responsavel: 12.345.678-9(se não tiver rg, usar o cpf_do_responsavel)
+    cpf_do_menor: 987.654.321-00
+    rg_do_menor: 98.765.432-1(se não tiver rg, usar o cpf_do_menor)
+    data_de_nascimento_do_menor: DD/MM/YYYY
+    endereço: rua abc, 123(só rua e número)
+    cep: 12345-678
+    cids: [10 F84.0, 11 6A02](podem ser 10 F84.0, 10 F84.1 ... 10 F84.9 ou FA02.0, FA02.1 ... FA02.5, FA02.Y, FA02.Z)
+    """
+
+# Prompt of the single call extraction, sent with the document images
+IMAGES_DATA_PROMPT = f"Extraia os dados das pessoas nestes documentos, com as chaves e regras deste exemplo:\n\n{FIELDS_DESCRIPTION}\n\nUse uma string vazia para os dados que não estiverem nos documentos."
+
+# Full instructions of the text parsing, as they were sent with every text. Only kept as the
+# baseline the compact instructions are measured against (see PromptCacheManager)
+TEXT_DATA_INSTRUCTIONS = f"""Você extrai os dados de um beneficiário do texto dos seus documentos.
+Responda apenas com uma string que possa ser usada num literal_eval do python para gerar um dicionário
+somente com as chaves pedidas, com os valores nas formas deste exemplo:
+
+{FIELDS_DESCRIPTION}"""
 
-def get_image_text(image_path, api_key=None):
+# Instructions of the text parsing. They are the same in every call, so they go in the model's
+# system instruction and only the text is sent per call
+COMPACT_TEXT_DATA_INSTRUCTIONS = (
+    "Responda só com um dict python (para literal_eval) com as chaves pedidas, extraídas do texto. "
+    "Formatos: cpf 000.000.000-00; rg como no documento (sem rg, o cpf da pessoa); data DD/MM/YYYY; "
+    "endereço só rua, número; cep 00000-000; cids lista como ['10 F84.0', '11 6A02'] "
+    "(10 F84.0 a 10 F84.9, 11 6A02.0 a 11 6A02.5, 11 6A02.Y, 11 6A02.Z)."
+)
+
+# Response schema for the single call extraction (JSON mode)
+DATA_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        field: {"type": "array", "items": {"type": "string"}} if field == "cids" else {"type": "string"}
+        for field in DATA_FIELDS
+    },
+    "required": DATA_FIELDS,
+}
+
+
+def _resolve_api_key(api_key=None):
     """
-    Extract all text from an image using Google's Generative AI.
+    Return the API key to use, falling back to GOOGLE_API_KEY from the environment.
     
     Args:
-        image_path (str): Path to the image file
-        api_key (str, optional): Google Generative AI API key. If not provided, will use GOOGLE_API_KEY from environment.
+        api_key (str, optional): Google Generative AI API key
         
     Returns:
-        str: Extracted text from the image
+        str: The API key
+        
+    Raises:
+        ValueError: If no API key is available
     """
-    # Use provided API key or get from environment
     if api_key is None:
         api_key = os.getenv("GOOGLE_API_KEY", "")
     
     if not api_key:
         raise ValueError("Google API Key not provided and not found in environment variables. Please configure it using the API Key button.")
     
+    return api_key
+
+
+class GeminiClientManager:
+    """
+    Configures the Gemini library once per API key and keeps the models alive between calls,
+    so consecutive extractions reuse the same client and its open connections.
+    
+    genai.configure is global to the process, so only one API key is active at a time;
+    switching keys reconfigures the library and drops the cached models.
+    Setting GEMINI_API_ENDPOINT in the environment (e.g. http://localhost:8080, see fake_gemini_server.py)
+    sends the requests to that server over REST instead. The REST transport has no async client,
+    so uses_rest tells the async callers to run the sync calls in a thread.
+    Safe to use from several threads.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._api_key = None
+        self._models = {}
+        self.uses_rest = False
+    
+    def get_model(self, api_key=None, model_name=DEFAULT_MODEL_NAME):
+        """
+        Get a ready to use model.
+        
+        Args:
+            api_key (str, optional): Google Generative AI API key. If not provided, will use GOOGLE_API_KEY from environment.
+            model_name (str, optional): Name of the model. Defaults to DEFAULT_MODEL_NAME
+            
+        Returns:
+            genai.GenerativeModel: The cached model for this key and name
+        """
+        api_key = _resolve_api_key(api_key)
+        
+        with self._lock:
+            if api_key != self._api_key:
+                endpoint = os.getenv("GEMINI_API_ENDPOINT")
+                if endpoint:
+                    genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": endpoint})
+                else:
+                    genai.configure(api_key=api_key)
+                self.uses_rest = bool(endpoint)
+                self._api_key = api_key
+                self._models = {}
+            
+            model = self._models.get(model_name)
+            if model is None:
+                model = genai.GenerativeModel(model_name=model_name)
+                self._models[model_name] = model
+            return model
+
+
+# Shared by every extraction in the process
+client_manager = GeminiClientManager()
+
+# Counts the tokens of the instruction variants once per model, off the critical path of the parsing
+_token_count_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="token_count")
+
+
+class PromptCacheManager:
+    """
+    Gives models for the text parsing with COMPACT_TEXT_DATA_INSTRUCTIONS as system instruction,
+    so each call only sends the text, and measures the tokens this saves.
+    
+    The instructions are too short for provider-side context caching (the models' minimum is
+    1024 or 4096 tokens), so the compact variant is the cache. The saving of each call is its
+    prompt_token_count against the same call with the full TEXT_DATA_INSTRUCTIONS, whose tokens
+    are counted by the API once per model in the background. Safe to use from several threads.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._api_key = None
+        self._models = {}
+        self._instruction_tokens = {}
+        self.stats = {"calls": 0, "measured_calls": 0, "tokens_sent": 0, "tokens_saved": 0}
+    
+    def _count_instruction_tokens(self, model):
+        """
+        Count the tokens of the full and the compact instructions, through request_policy.
+        
+        Returns:
+            tuple: (full instruction tokens, compact instruction tokens)
+        """
+        full, compact = (
+            request_policy.call(
+                lambda timeout, text=text: model.count_tokens(text, request_options=_request_options(timeout)),
+                kind="count_tokens",
+            ).total_tokens
+            for text in (TEXT_DATA_INSTRUCTIONS, COMPACT_TEXT_DATA_INSTRUCTIONS)
+        )
+        return full, compact
+    
+    def get_model(self, api_key=None, model_name=DEFAULT_MODEL_NAME):
+        """
+        Get a model for the text parsing.
+        
+        Args:
+            api_key (str, optional): Google Generative AI API key. If not provided, will use GOOGLE_API_KEY from environment.
+            model_name (str, optional): Name of the model. Defaults to DEFAULT_MODEL_NAME
+            
+        Returns:
+            genai.GenerativeModel: The model, with the compact instructions in place
+        """
+        # Configures the library for this key
+        plain_model = client_manager.get_model(api_key, model_name)
+        api_key = _resolve_api_key(api_key)
+        
+        with self._lock:
+            if api_key != self._api_key:
+                self._api_key = api_key
+                self._models = {}
+            
+            model = self._models.get(model_name)
+            if model is None:
+                model = genai.GenerativeModel(model_name=model_name, system_instruction=COMPACT_TEXT_DATA_INSTRUCTIONS)
+                self._models[model_name] = model
+            if model_name not in self._instruction_tokens:
+                self._instruction_tokens[model_name] = _token_count_executor.submit(
+                    self._count_instruction_tokens, plain_model
+                )
+            return model
+    
+    def record_call(self, response, model_name):
+        """
+        Measure the tokens saved by a call and print them.
+        
+        Args:
+            response: Response of the call
+            model_name (str): Name of the model
+        """
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None)
+        
+        with self._lock:
+            counting = self._instruction_tokens.get(model_name)
+        instruction_tokens = None
+        if counting is not None and counting.done():
+            try:
+                instruction_tokens = counting.result()
+            except Exception as e:
+                print(f"Warning: Could not count the instruction tokens: {e}")
+                with self._lock:
+                    # Counted again with the next model request
+                    self._instruction_tokens.pop(model_name, None)
+        
+        tokens_saved = None
+        if prompt_tokens is not None and instruction_tokens is not None:
+            full_tokens, compact_tokens = instruction_tokens
+            tokens_saved = full_tokens - compact_tokens
+            # The same call with the full instructions
+            baseline_tokens = prompt_tokens + tokens_saved
+        
+        with self._lock:
+            self.stats["calls"] += 1
+            if tokens_saved is not None:
+                self.stats["measured_calls"] += 1
+                self.stats["tokens_sent"] += prompt_tokens
+                self.stats["tokens_saved"] += tokens_saved
+        
+        if tokens_saved is not None:
+            print(f"Text parsing prompt: {prompt_tokens} input tokens, {tokens_saved} saved by the compact "
+                  f"instructions ({tokens_saved / baseline_tokens:.0%} of {baseline_tokens})")
+        elif prompt_tokens is not None:
+            print(f"Text parsing prompt: {prompt_tokens} input tokens (savings not measured yet)")
+    
+    def get_stats(self):
+        """
+        Get the tokens sent and saved since the program started.
+        
+        Returns:
+            dict: calls, measured_calls (calls whose saving is known), tokens_sent, tokens_saved
+                  and tokens_saved_per_call (over the measured calls)
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        stats["tokens_saved_per_call"] = stats["tokens_saved"] / stats["measured_calls"] if stats["measured_calls"] else 0.0
+        return stats
+
+
+# Shared by every text parsing in the process
+prompt_cache = PromptCacheManager()
+
+# Seconds a single Gemini request may take, and all its retries together
+GEMINI_REQUEST_TIMEOUT_SECONDS = 120
+GEMINI_TOTAL_TIMEOUT_SECONDS = 300
+
+# Send a second copy of requests slower than the usual 95th percentile (costs an extra request when it happens)
+HEDGE_GEMINI_REQUESTS = False
+
+# Requests per minute allowed by the API key's quota, and how many may be sent at once after a pause
+GEMINI_REQUESTS_PER_MINUTE = 60
+GEMINI_BURST_REQUESTS = 5
+
+# File through which every process on this machine shares the requests per minute
+RATE_LIMIT_STATE_PATH = Path.home() / ".auto_preenchedor_data" / "gemini_rate_limit.bin"
+
+# Requests in flight at the start and at most; lowered on 429 errors and raised back while requests succeed
+GEMINI_INITIAL_CONCURRENCY = MAX_CONCURRENT_OCR_REQUESTS
+GEMINI_MAX_CONCURRENCY = 16
+
+# Deadlines, retries, hedging and rate limits of every Gemini request in the process
+request_policy = RequestPolicy(
+    timeout=GEMINI_REQUEST_TIMEOUT_SECONDS,
+    total_timeout=GEMINI_TOTAL_TIMEOUT_SECONDS,
+    hedge=HEDGE_GEMINI_REQUESTS,
+    rate_limiter=TokenBucket(GEMINI_REQUESTS_PER_MINUTE / 60, GEMINI_BURST_REQUESTS, RATE_LIMIT_STATE_PATH),
+    concurrency=AIMDController(GEMINI_INITIAL_CONCURRENCY, max_limit=GEMINI_MAX_CONCURRENCY),
+)
+
+
+def _request_options(timeout):
+    """
+    Options of one Gemini request sent through request_policy.
+    
+    The library's own retries are turned off: request_policy already retries, and a retry loop left
+    running in a request that missed its deadline would keep its thread and its concurrency slot.
+    
+    Args:
+        timeout (float): Seconds the attempt has left
+        
+    Returns:
+        dict: The request_options of generate_content
+    """
+    return {"timeout": timeout, "retry": None}
+
+# Folder and size limit of the cache of AI responses
+EXTRACTION_CACHE_DIR = Path.home() / ".auto_preenchedor_data" / ".extraction_cache"
+EXTRACTION_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+
+class ExtractionCache:
+    """
+    Disk cache of AI responses, keyed by the content of the inputs (image bytes or text),
+    the prompt and the model name.
+    
+    Each entry is a JSON file with the raw response text and the parsed data. Reading an entry
+    refreshes its modification time, and the least recently used entries are deleted when the
+    cache grows above max_bytes.
+    """
+    
+    def __init__(self, cache_dir=EXTRACTION_CACHE_DIR, max_bytes=EXTRACTION_CACHE_MAX_BYTES):
+        """
+        Initialize the cache.
+        
+        Args:
+            cache_dir (Path, optional): Folder of the cache files. Defaults to EXTRACTION_CACHE_DIR
+            max_bytes (int, optional): Maximum total size of the cache. Defaults to EXTRACTION_CACHE_MAX_BYTES
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+    
+    def make_key(self, model_name, prompt, image_paths=(), text=None):
+        """
+        Build the cache key of a request.
+        
+        Args:
+            model_name (str): Name of the model
+            prompt (str): Prompt sent with the inputs
+            image_paths (list, optional): Images sent with the prompt. Their content is hashed, not their path
+            text (str, optional): Text sent with the prompt
+            
+        Returns:
+            str: Hex digest identifying the request
+        """
+        hasher = hashlib.sha256()
+        for part in (model_name, prompt, text or ""):
+            hasher.update(part.encode("utf-8"))
+            hasher.update(b"\0")
+        for image_path in image_paths:
+            with open(image_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    hasher.update(chunk)
+            hasher.update(b"\0")
+        return hasher.hexdigest()
+    
+    def get(self, key):
+        """
+        Get a cached entry.
+        
+        Args:
+            key (str): Key from make_key
+            
+        Returns:
+            dict: Entry with the keys text and data, or None if not cached
+        """
+        entry_path = self.cache_dir / f"{key}.json"
+        try:
+            with open(entry_path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(entry_path)  # Mark as recently used
+            return entry
+        except (OSError, ValueError):
+            return None
+    
+    def put(self, key, text, data=None):
+        """
+        Store an entry and evict the least recently used ones if the cache is too big.
+        
+        Args:
+            key (str): Key from make_key
+            text (str): Raw response text
+            data (dict, optional): Parsed data. Defaults to None
+        """
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            entry_path = self.cache_dir / f"{key}.json"
+            temp_path = entry_path.with_suffix(f".{threading.get_ident()}.tmp")
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"text": text, "data": data}, f, ensure_ascii=False)
+            os.replace(temp_path, entry_path)
+            self._evict()
+        except OSError as e:
+            print(f"Warning: Could not write to the extraction cache: {e}")
+    
+    def _evict(self):
+        """Delete the least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = []
+            for entry_path in self.cache_dir.glob("*.json"):
+                try:
+                    stat = entry_path.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+            
+            total_bytes = sum(size for _, size, _ in entries)
+            for _, size, entry_path in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                entry_path.unlink(missing_ok=True)
+                total_bytes -= size
+
+
+# Shared by every extraction in the process
+extraction_cache = ExtractionCache()
+
+
+def get_image_text(image_path, api_key=None, use_cache=True):
+    """
+    Extract all text from an image using Google's Generative AI.
+    
+    Args:
+        image_path (str): Path to the image file
+        api_key (str, optional): Google Generative AI API key. If not provided, will use GOOGLE_API_KEY from environment.
+        use_cache (bool, optional): Reuse the response of a previous call with the same image. Defaults to True
+        
+    Returns:
+        str: Extracted text from the image
+    """
+    prompt = IMAGE_TEXT_PROMPT
+
+    cache_key = extraction_cache.make_key(DEFAULT_MODEL_NAME, prompt, image_paths=[image_path])
+    cached = extraction_cache.get(cache_key) if use_cache else None
+    if cached:
+        print(cached["text"])
+        return cached["text"]
+
+    model = client_manager.get_model(api_key)
+    
     image = Image.open(image_path)
-    prompt = "Extract all the text in this image and provide it as plain text."
 
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel(model_name="gemini-2.5-pro")
-    response = model.generate_content([image, prompt])
+    response = request_policy.call(
+        lambda timeout: model.generate_content([image, prompt], request_options=_request_options(timeout)),
+        kind="image_text",
+    )
 
     print(response.text)
+    extraction_cache.put(cache_key, response.text)
     return response.text
 
 
-def get_data_from_text(text, api_key=None):
+class OCREngine:
+    """
+    Base class of the engines that read the text of a document image.
+    """
+    
+    name = "base"
+    
+    def is_available(self):
+        """
+        Check if the engine can be used on this machine.
+        
+        Returns:
+            bool: True if get_text can be called
+        """
+        return True
+    
+    def get_text(self, image_path):
+        """
+        Extract all text from an image.
+        
+        Args:
+            image_path (str): Path to the image file
+            
+        Returns:
+            str: Extracted text from the image
+        """
+        raise NotImplementedError
+
+
+class TesseractOCREngine(OCREngine):
+    """
+    Local OCR with Tesseract, runs offline on the CPU.
+    Needs the pytesseract package and the Tesseract program with the Portuguese language data.
+    """
+    
+    name = "tesseract"
+    
+    def __init__(self, lang="por", tesseract_cmd=None):
+        """
+        Initialize the engine.
+        
+        Args:
+            lang (str, optional): Tesseract language(s). Defaults to "por"
+            tesseract_cmd (str, optional): Path to the tesseract executable, if it is not in the PATH
+        """
+        self.lang = lang
+        if pytesseract is not None and tesseract_cmd:
+            pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    
+    def is_available(self):
+        """Check that pytesseract is installed and the tesseract program can be run."""
+        if pytesseract is None:
+            return False
+        try:
+            pytesseract.get_tesseract_version()
+            return True
+        except Exception:
+            return False
+    
+    def get_text(self, image_path):
+        """Extract all text from an image with Tesseract."""
+        with Image.open(image_path) as image:
+            # Phone photos are often rotated through EXIF only, and Tesseract reads grayscale better
+            image = ImageOps.exif_transpose(image).convert("L")
+            text = pytesseract.image_to_string(image, lang=self.lang)
+        print(text)
+        return text
+
+
+class GeminiOCREngine(OCREngine):
+    """
+    Cloud OCR with Google's Generative AI (see get_image_text).
+    """
+    
+    name = "gemini"
+    
+    def __init__(self, api_key=None, use_cache=True):
+        """
+        Initialize the engine.
+        
+        Args:
+            api_key (str, optional): Google Generative AI API key. If not provided, will use GOOGLE_API_KEY from environment.
+            use_cache (bool, optional): Reuse the responses of previous calls. Defaults to True
+        """
+        self.api_key = api_key
+        self.use_cache = use_cache
+    
+    def get_text(self, image_path):
+        """Extract all text from an image with Gemini."""
+        return get_image_text(image_path, self.api_key, self.use_cache)
+
+
+# Event loop of the async requests. It lives for the whole process, in its own thread, because the
+# library's async client is bound to the loop it was first used on.
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+
+def _run_async(coroutine):
+    """
+    Run a coroutine on the shared background event loop and wait for its result.
+    
+    Args:
+        coroutine: The coroutine to run
+        
+    Returns:
+        The coroutine's result
+    """
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            _event_loop = asyncio.new_event_loop()
+            threading.Thread(target=_event_loop.run_forever, daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coroutine, _event_loop).result()
+
+
+async def _get_image_text_async(image_path, model, semaphore, use_cache=True):
+    """
+    Extract all text from one image without blocking the other requests.
+    
+    Args:
+        image_path (str): Path to the image file
+        model (genai.GenerativeModel): Model to use
+        semaphore (asyncio.Semaphore): Limits how many requests run at the same time
+        use_cache (bool, optional): Reuse the response of a previous call with the same image. Defaults to True
+        
+    Returns:
+        str: Extracted text from the image, or an empty string if it could not be read
+    """
+    try:
+        cache_key = extraction_cache.make_key(DEFAULT_MODEL_NAME, IMAGE_TEXT_PROMPT, image_paths=[image_path])
+        cached = extraction_cache.get(cache_key) if use_cache else None
+        if cached:
+            return cached["text"]
+
+        async with semaphore:
+            image = Image.open(image_path)
+            if client_manager.uses_rest:
+                # No async client over REST: the sync call runs in a thread, still under the async policy
+                def request(timeout):
+                    return asyncio.to_thread(
+                        model.generate_content, [image, IMAGE_TEXT_PROMPT], request_options=_request_options(timeout)
+                    )
+            else:
+                def request(timeout):
+                    return model.generate_content_async([image, IMAGE_TEXT_PROMPT], request_options=_request_options(timeout))
+            response = await request_policy.call_async(request, kind="image_text")
+        extraction_cache.put(cache_key, response.text)
+        return response.text
+    except Exception as e:
+        # One unreadable document must not spoil the others
+        print(f"Error extracting text from {image_path}: {e}")
+        return ""
+
+
+async def get_images_text_async(image_paths, api_key=None, max_concurrency=MAX_CONCURRENT_OCR_REQUESTS, use_cache=True):
+    """
+    Extract the text of several images concurrently, one request per image.
+    
+    Args:
+        image_paths (list): Paths to the image files
+        api_key (str, optional): Google Generative AI API key. If not provided, will use GOOGLE_API_KEY from environment.
+        max_concurrency (int, optional): Maximum number of requests at the same time. Defaults to MAX_CONCURRENT_OCR_REQUESTS
+        use_cache (bool, optional): Reuse the responses of previous calls with the same images. Defaults to True
+        
+    Returns:
+        list: Extracted text of each image, in the same order (empty string for images that failed)
+    """
+    model = client_manager.get_model(api_key)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    return await asyncio.gather(
+        *(_get_image_text_async(image_path, model, semaphore, use_cache) for image_path in image_paths)
+    )
+
+
+def _merge_document_texts(names, texts):
+    """
+    Merge the texts of several documents, each under a "=== name ===" header (see local_extractor).
+    
+    Args:
+        names (list): Document names (e.g. "laudo_medico")
+        texts (list): Text of each document, in the same order (empty for documents that could not be read)
+        
+    Returns:
+        str: The merged text, empty if no document had text
+    """
+    return "\n\n".join(f"=== {name} ===\n{text}" for name, text in zip(names, texts) if text)
+
+
+def get_data_from_documents(documents, api_key=None, max_concurrency=MAX_CONCURRENT_OCR_REQUESTS, use_cache=True):
+    """
+    Extract structured data by reading each document separately and concurrently, instead of a collage.
+    
+    The wall-clock time of the text extraction is about that of the slowest document, and a document
+    that cannot be read only loses its own text. The texts are merged, labelled with the document names,
+    and parsed with get_data_from_text.
+    
+    Args:
+        documents (dict): Dictionary mapping document names (e.g. "laudo_medico") to image paths
+        api_key (str, optional): Google Generative AI API key. If not provided, will use GOOGLE_API_KEY from environment.
+        max_concurrency (int, optional): Maximum number of requests at the same time. Defaults to MAX_CONCURRENT_OCR_REQUESTS
+        use_cache (bool, optional): Reuse the responses of previous calls. Defaults to True
+        
+    Returns:
+        dict: Dictionary containing extracted user data (see get_data_from_text), or None if parsing failed
+    """
+    names = list(documents.keys())
+    texts = _run_async(get_images_text_async(list(documents.values()), api_key, max_concurrency, use_cache))
+
+    merged_text = _merge_document_texts(names, texts)
+    if not merged_text:
+        print("Error: No text could be extracted from the documents.")
+        return None
+    print(merged_text)
+
+    return get_data_from_text(merged_text, api_key, use_cache)
+
+
+# Fields the local extractor finds but the AI is still asked for: a CID mentioned in the text is
+# not necessarily the diagnosis, so the local CIDs only confirm the AI's answer
+LOCAL_HINT_FIELDS = ["cids"]
+
+# Fields that, when all resolved locally, make the AI call unnecessary: the required ones and every
+# strict-format one. The rest (mother's name, street number, CIDs) is left for the operator to fill in
+SKIP_AI_FIELDS = [*REQUIRED_FIELDS, "cpf_do_responsavel", "rg_do_responsavel", "rg_do_menor", "cep"]
+
+# How many fields the local extractor resolved instead of the AI, and how many AI calls it avoided
+local_extraction_stats = {"parses": 0, "fields_resolved_locally": 0, "fields_asked_to_ai": 0, "ai_calls_avoided": 0}
+_local_extraction_stats_lock = threading.Lock()
+
+
+def _record_local_extraction(fields_resolved, fields_asked):
+    """
+    Update local_extraction_stats after a local extraction.
+    
+    Args:
+        fields_resolved (int): Number of fields found locally, left out of the AI prompt
+        fields_asked (int): Number of fields the AI is asked for, 0 if the AI call is avoided
+    """
+    with _local_extraction_stats_lock:
+        local_extraction_stats["parses"] += 1
+        local_extraction_stats["fields_resolved_locally"] += fields_resolved
+        local_extraction_stats["fields_asked_to_ai"] += fields_asked
+        if not fields_asked:
+            local_extraction_stats["ai_calls_avoided"] += 1
+
+
+def get_local_extraction_stats():
+    """
+    Get how many fields and AI calls the local extractor saved since the program started.
+    
+    Returns:
+        dict: parses, fields_resolved_locally, fields_asked_to_ai, ai_calls_avoided,
+              fields_resolved_locally_rate and ai_calls_avoided_rate (0 to 1)
+    """
+    with _local_extraction_stats_lock:
+        stats = dict(local_extraction_stats)
+    total = stats["fields_resolved_locally"] + stats["fields_asked_to_ai"]
+    stats["fields_resolved_locally_rate"] = stats["fields_resolved_locally"] / total if total else 0.0
+    stats["ai_calls_avoided_rate"] = stats["ai_calls_avoided"] / stats["parses"] if stats["parses"] else 0.0
+    return stats
+
+
+def _extract_locally(text):
+    """
+    Run the local extraction of one text and record it in local_extraction_stats.
+    
+    Args:
+        text (str): Raw text containing user information
+        
+    Returns:
+        tuple: (fields found locally, fields the AI must be asked for). The list is empty when
+               every field of SKIP_AI_FIELDS was found, i.e. the AI call can be avoided
+    """
+    local_fields = extract_fields_locally(text)
+    if all(field in local_fields for field in SKIP_AI_FIELDS):
+        missing_fields = []
+        fields_resolved = len([field for field in local_fields if field not in LOCAL_HINT_FIELDS])
+    else:
+        missing_fields = [field for field in DATA_FIELDS if field not in local_fields or field in LOCAL_HINT_FIELDS]
+        fields_resolved = len(DATA_FIELDS) - len(missing_fields)
+    _record_local_extraction(fields_resolved, len(missing_fields))
+    stats = get_local_extraction_stats()
+    if missing_fields:
+        print(f"Local extraction: {fields_resolved}/{len(DATA_FIELDS)} fields left out of the AI prompt "
+              f"({stats['fields_resolved_locally_rate']:.0%} since the start)")
+    else:
+        print(f"Local extraction: all the required fields found, AI call avoided "
+              f"({stats['ai_calls_avoided_rate']:.0%} of the texts since the start)")
+    return local_fields, missing_fields
+
+
+def _local_only_result(local_fields):
+    """
+    Build the data of a text whose AI call was avoided.
+    
+    Args:
+        local_fields (dict): Fields from extract_fields_locally
+        
+    Returns:
+        dict: Same keys as get_data_from_text, with the fields not found locally (and the
+              hint-only ones) left empty for the operator
+    """
+    extracted_dict = {field: [] if field == "cids" else "" for field in DATA_FIELDS}
+    extracted_dict.update({field: value for field, value in local_fields.items() if field not in LOCAL_HINT_FIELDS})
+    print(extracted_dict)
+    _apply_street_from_cep(extracted_dict)
+    return extracted_dict
+
+
+def _merge_local_fields(extracted_dict, local_fields):
+    """
+    Put the locally extracted fields over the AI's answer.
+    
+    The local values were validated (and the CEP only comes from the residence proof), so they win,
+    except the CIDs: those are kept from the AI and only take the local formatting when both found
+    the same codes.
+    
+    Args:
+        extracted_dict (dict): Data returned by the AI, updated in place
+        local_fields (dict): Fields from extract_fields_locally
+    """
+    for field, value in local_fields.items():
+        if field == "cids":
+            ai_cids = extracted_dict.get("cids") or []
+            if isinstance(ai_cids, str):
+                ai_cids = [ai_cids]
+            normalized = {cid for ai_cid in ai_cids for cid in find_cids_in_text(str(ai_cid))}
+            if normalized == set(value):
+                extracted_dict["cids"] = value
+        else:
+            extracted_dict[field] = value
+
+
+def _text_data_prompt(text, missing_fields):
+    """
+    Build the per-call part of the parsing prompt of one text (the instructions are in the
+    model's system instruction, see PromptCacheManager).
+    
+    Args:
+        text (str): Raw text containing user information
+        missing_fields (list): Fields the AI must extract
+        
+    Returns:
+        str: The prompt
+    """
+    return f"Chaves: {', '.join(missing_fields)}\n\nTexto:\n{text}"
+
+
+def get_data_from_text(text, api_key=None, use_cache=True, model_name=DEFAULT_MODEL_NAME):
     """
     Extract structured data from text using Google's Generative AI.
     
+    Fields with strict formats (CPF, RG, CEP, dates, CIDs) are extracted locally first
+    (see local_extractor.py), and the AI is only asked for the fields that could not be determined.
+    When every field of SKIP_AI_FIELDS is found locally the AI is not called at all.
+    The instructions are not resent on every call (see PromptCacheManager).
+    
     Args:
         text (str): Raw text containing user information
         api_key (str, optional): Google Generative AI API key. If not provided, will use GOOGLE_API_KEY from environment.
+        use_cache (bool, optional): Reuse the response of a previous call with the same text. Defaults to True
+        model_name (str, optional): Model used for the parsing. Defaults to DEFAULT_MODEL_NAME
         
     Returns:
         dict: Dictionary containing extracted user data with keys:
@@ -68,34 +887,48 @@ def get_data_from_text(text, api_key=None):
             - cep
             - cids
     """
-    # Use provided API key or get from environment
-    if api_key is None:
-        api_key = os.getenv("GOOGLE_API_KEY", "")
-    
-    if not api_key:
-        raise ValueError("Google API Key not provided and not found in environment variables. Please configure it using the API Key button.")
-    
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel(model_name="gemini-2.5-pro")
+    # Fields with strict formats are read locally first, the AI is only asked for the others
+    local_fields, missing_fields = _extract_locally(text)
+    if not missing_fields:
+        return _local_only_result(local_fields)
+    return _parse_text(text, local_fields, missing_fields, api_key, use_cache, model_name)
 
-    text_input = """
-    User Information:
-    nome_do_responsavel: maria
-    nome_do_menor: joao
-    nome_da_mae_do_menor: ana silva
-    cpf_do_responsavel: 123.456.789-00
-    rg_do_responsavel: 12.345.678-9(se não tiver rg, usar o cpf_do_responsavel)
-    cpf_do_menor: 987.654.321-00
-    rg_do_menor: 98.765.432-1(se não tiver rg, usar o cpf_do_menor)
-    data_de_nascimento_do_menor: DD/MM/YYYY
-    endereço: rua abc, 123(só rua e número)
-    cep: 12345-678
-    cids: [10 F84.0, 11 6A02](podem ser 10 F84.0, 10 F84.1 ... 10 F84.9 ou FA02.0, FA02.1 ... FA02.5, FA02.Y, FA02.Z)
+
+def _parse_text(text, local_fields, missing_fields, api_key=None, use_cache=True, model_name=DEFAULT_MODEL_NAME):
     """
+    Ask the AI for the fields of a text that the local extraction did not resolve.
+    
+    Args:
+        text (str): Raw text containing user information
+        local_fields (dict): Fields from the local extraction
+        missing_fields (list): Fields the AI must extract
+        api_key (str, optional): Google Generative AI API key. If not provided, will use GOOGLE_API_KEY from environment.
+        use_cache (bool, optional): Reuse the response of a previous call with the same text. Defaults to True
+        model_name (str, optional): Model used for the parsing. Defaults to DEFAULT_MODEL_NAME
+        
+    Returns:
+        dict: Same as get_data_from_text
+    """
+    prompt = _text_data_prompt(text, missing_fields)
+
+    cache_key = extraction_cache.make_key(model_name, COMPACT_TEXT_DATA_INSTRUCTIONS + prompt)
+    cached = extraction_cache.get(cache_key) if use_cache else None
+    if cached and cached["data"] is not None:
+        extracted_dict = cached["data"]
+        print(extracted_dict)
+        _apply_street_from_cep(extracted_dict)
+        return extracted_dict
+
+    model = prompt_cache.get_model(api_key, model_name)
 
-    prompt = f"Extraia um dicionário python com as chaves nome_do_responsavel, nome_do_menor, nome_da_mae_do_menor, cpf_do_responsavel, rg_do_responsavel, cpf_do_menor, rg_do_menor, data_de_nascimento_do_menor, endereço, cep, cid dessa forma:\n\n{text_input}\n\ com base no seguinte texto:\n\n{text}\n\nResponda apenas com uma string que possa ser usada num literal_eval do python para gerar o dicionário."
+    # Resolve the CEPs found in the text while the model is parsing it
+    street_lookups = _prefetch_streets_from_text(text)
 
-    response = model.generate_content(prompt)
+    response = request_policy.call(
+        lambda timeout: model.generate_content(prompt, request_options=_request_options(timeout)),
+        kind="text_data",
+    )
+    prompt_cache.record_call(response, model_name)
     extracted_dict_str = response.text.strip()
     extracted_dict_str = extracted_dict_str.split("{")[1].split("}")[0].replace("\n", " ").strip().replace("\\", "")
     extracted_dict_str = "{" + extracted_dict_str + "}"
@@ -104,29 +937,733 @@ def get_data_from_text(text, api_key=None):
     try:
         # Use ast.literal_eval for safe evaluation of string representation of Python literals
         extracted_dict = ast.literal_eval(extracted_dict_str)
+        _merge_local_fields(extracted_dict, local_fields)
         print(extracted_dict)
+        extraction_cache.put(cache_key, response.text, extracted_dict)
 
-        street_cep = get_street_from_cep(extracted_dict.get("cep", ""))
-
-        if street_cep:
-            numero = extracted_dict.get("endereço", "").split(",")[1].strip() if "," in extracted_dict.get("endereço", "") else ""
-            full_address = f"{street_cep}, {numero}".strip(", ")
-            extracted_dict["endereço"] = full_address
+        _apply_street_from_cep(extracted_dict, street_lookups)
         return extracted_dict
     except (ValueError, SyntaxError) as e:
         print(f"Error parsing dictionary from LLM response: {e}")
         print(f"Raw LLM response: {extracted_dict_str}")
         return None
+
+
+# Texts parsed per request by get_data_from_texts, and the size limit of a request's texts
+BATCH_PARSE_SIZE = 8
+BATCH_PARSE_MAX_CHARS = 60_000
+
+# Key identifying each record in a batch request and its response
+BATCH_RECORD_FIELD = "registro"
+
+# Prompt of the batch parsing, followed by the delimited texts
+BATCH_DATA_PROMPT = f"""Cada registro abaixo é o texto dos documentos de um beneficiário diferente, entre <<<REGISTRO n>>> e <<<FIM DO REGISTRO n>>>.
+Para cada registro, extraia os dados com as chaves e regras deste exemplo, e informe o número do registro em "{BATCH_RECORD_FIELD}":
+
+{FIELDS_DESCRIPTION}
+
+Use somente o texto do próprio registro e uma string vazia para os dados que não estiverem nele."""
+
+# Response schema of the batch parsing: one object per record
+BATCH_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {BATCH_RECORD_FIELD: {"type": "integer"}, **DATA_RESPONSE_SCHEMA["properties"]},
+        "required": [BATCH_RECORD_FIELD, *DATA_FIELDS],
+    },
+}
+
+
+def _split_into_batches(records, batch_size=BATCH_PARSE_SIZE, max_chars=BATCH_PARSE_MAX_CHARS):
+    """
+    Group records into batches, in order, limited by count and by text size.
     
+    Args:
+        records (list): (index, text) pairs
+        batch_size (int, optional): Maximum records per batch. Defaults to BATCH_PARSE_SIZE
+        max_chars (int, optional): Maximum characters of text per batch. Defaults to BATCH_PARSE_MAX_CHARS
+        
+    Returns:
+        list: Lists of (index, text) pairs
+    """
+    batches = []
+    batch = []
+    batch_chars = 0
+    for index, text in records:
+        if batch and (len(batch) == batch_size or batch_chars + len(text) > max_chars):
+            batches.append(batch)
+            batch = []
+            batch_chars = 0
+        batch.append((index, text))
+        batch_chars += len(text)
+    if batch:
+        batches.append(batch)
+    return batches
+
 
-def get_street_from_cep(cep):
+def _parse_batch(batch, model):
+    """
+    Parse the texts of one batch in a single request.
+    
+    Args:
+        batch (list): (index, text) pairs
+        model (genai.GenerativeModel): Model to use
+        
+    Returns:
+        dict: Mapping each index to the data the AI returned for it. Records missing from the
+              response or returned malformed are left out
+    """
+    records_text = "\n\n".join(
+        f"<<<REGISTRO {number}>>>\n{text}\n<<<FIM DO REGISTRO {number}>>>"
+        for number, (_, text) in enumerate(batch, 1)
+    )
+    response = request_policy.call(
+        lambda timeout: model.generate_content(
+            f"{BATCH_DATA_PROMPT}\n\n{records_text}",
+            generation_config=genai.GenerationConfig(
+                response_mime_type="application/json",
+                response_schema=BATCH_RESPONSE_SCHEMA,
+            ),
+            request_options=_request_options(timeout),
+        ),
+        kind="batch_text_data",
+    )
+
+    records = json.loads(response.text)
+    if not isinstance(records, list):
+        raise ValueError(f"Expected a JSON array, got: {response.text}")
+
+    parsed = {}
+    duplicated = set()
+    for record in records:
+        if not isinstance(record, dict):
+            continue
+        number = record.pop(BATCH_RECORD_FIELD, None)
+        if not isinstance(number, int) or not 1 <= number <= len(batch):
+            continue
+        if number in parsed:
+            duplicated.add(number)
+        parsed[number] = record
+    # A record answered twice is ambiguous, so it is parsed again alone
+    return {batch[number - 1][0]: record for number, record in parsed.items() if number not in duplicated}
+
+
+def get_data_from_texts(texts, api_key=None, use_cache=True, model_name=DEFAULT_MODEL_NAME,
+                        batch_size=BATCH_PARSE_SIZE, max_workers=MAX_CONCURRENT_OCR_REQUESTS):
+    """
+    Extract structured data from the texts of many beneficiaries, several texts per AI request.
+    
+    Each text is handled like in get_data_from_text (local extraction first, possibly avoiding the AI,
+    cache, street from CEP), but the texts the AI must parse are sent together, delimited per record,
+    and the batches run concurrently. A record missing from its batch's response, or a whole batch that fails, is
+    parsed again alone with get_data_from_text, so one bad record does not spoil the others.
+    
+    Args:
+        texts (list): Raw text of each beneficiary
+        api_key (str, optional): Google Generative AI API key. If not provided, will use GOOGLE_API_KEY from environment.
+        use_cache (bool, optional): Reuse the responses of previous calls with the same texts. Defaults to True
+        model_name (str, optional): Model used for the parsing. Defaults to DEFAULT_MODEL_NAME
+        batch_size (int, optional): Maximum texts per request. Defaults to BATCH_PARSE_SIZE
+        max_workers (int, optional): Batches sent at the same time. Defaults to MAX_CONCURRENT_OCR_REQUESTS
+        
+    Returns:
+        list: For each text, in the same order, the extracted data (same keys as get_data_from_text)
+              or None if it could not be parsed
+    """
+    results = [None] * len(texts)
+    local_fields = {}
+    missing_fields = {}
+    cache_keys = {}
+    pending = []
+    for index, text in enumerate(texts):
+        local_fields[index], missing_fields[index] = _extract_locally(text)
+        if not missing_fields[index]:
+            results[index] = _local_only_result(local_fields[index])
+            continue
+
+        # Same key as get_data_from_text, so both share the cached responses
+        cache_keys[index] = extraction_cache.make_key(
+            model_name, COMPACT_TEXT_DATA_INSTRUCTIONS + _text_data_prompt(text, missing_fields[index])
+        )
+        cached = extraction_cache.get(cache_keys[index]) if use_cache else None
+        if cached and cached["data"] is not None:
+            results[index] = cached["data"]
+            _apply_street_from_cep(results[index])
+        else:
+            pending.append((index, text))
+
+    print(f"Batch parsing: {len(texts) - len(pending)}/{len(texts)} texts resolved locally or from the cache")
+
+    if pending:
+        model = client_manager.get_model(api_key, model_name)
+        street_lookups = {index: _prefetch_streets_from_text(text) for index, text in pending}
+        batches = _split_into_batches(pending, batch_size)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_parse_batch, batch, model) for batch in batches]
+            for batch, future in zip(batches, futures):
+                try:
+                    parsed = future.result()
+                except Exception as e:
+                    print(f"Batch of {len(batch)} texts failed ({e}), parsing them one by one.")
+                    parsed = {}
+
+                for index, text in batch:
+                    if index in parsed:
+                        extracted_dict = parsed[index]
+                        _merge_local_fields(extracted_dict, local_fields[index])
+                        extraction_cache.put(cache_keys[index], json.dumps(extracted_dict, ensure_ascii=False), extracted_dict)
+                        _apply_street_from_cep(extracted_dict, street_lookups[index])
+                        results[index] = extracted_dict
+                        continue
+
+                    try:
+                        results[index] = _parse_text(
+                            text, local_fields[index], missing_fields[index], api_key, use_cache, model_name
+                        )
+                    except Exception as e:
+                        print(f"Error parsing text {index + 1}: {e}")
+
+    return results
+
+
+def _images_data_cache_key(image_paths, model_name=DEFAULT_MODEL_NAME):
+    """
+    Cache key of a single call extraction. The schema is part of the request, so it is part of the key too.
+    
+    Args:
+        image_paths (list): Paths to the image files
+        model_name (str, optional): Name of the model. Defaults to DEFAULT_MODEL_NAME
+        
+    Returns:
+        str: The cache key
+    """
+    return extraction_cache.make_key(
+        model_name, IMAGES_DATA_PROMPT + json.dumps(DATA_RESPONSE_SCHEMA, sort_keys=True), image_paths=image_paths
+    )
+
+
+def get_data_from_images(image_paths, api_key=None, fallback_to_two_step=True, use_cache=True,
+                         model_name=DEFAULT_MODEL_NAME):
+    """
+    Extract structured data directly from document images in a single AI call.
+    
+    The images are sent together with a JSON response schema, so the fields come back already
+    structured, instead of extracting the text first and parsing it in a second call.
+    If that fails and fallback_to_two_step is set, get_image_text + get_data_from_text are used.
+    
+    Args:
+        image_paths (list): Paths to the image files (e.g. a single collage)
+        api_key (str, optional): Google Generative AI API key. If not provided, will use GOOGLE_API_KEY from environment.
+        fallback_to_two_step (bool, optional): Use the two call extraction if the single call fails. Defaults to True
+        use_cache (bool, optional): Reuse the response of a previous call with the same images. Defaults to True
+        model_name (str, optional): Model used for the extraction. Defaults to DEFAULT_MODEL_NAME
+        
+    Returns:
+        dict: Dictionary containing extracted user data with the keys in DATA_FIELDS, or None if parsing failed
+    """
+    prompt = IMAGES_DATA_PROMPT
+
+    cache_key = _images_data_cache_key(image_paths, model_name)
+    cached = extraction_cache.get(cache_key) if use_cache else None
+    if cached and cached["data"] is not None:
+        extracted_dict = cached["data"]
+        print(extracted_dict)
+        _apply_street_from_cep(extracted_dict)
+        return extracted_dict
+
+    model = client_manager.get_model(api_key, model_name)
+
+    try:
+        images = [Image.open(image_path) for image_path in image_paths]
+        response = request_policy.call(
+            lambda timeout: model.generate_content(
+                [*images, prompt],
+                generation_config=genai.GenerationConfig(
+                    response_mime_type="application/json",
+                    response_schema=DATA_RESPONSE_SCHEMA,
+                ),
+                request_options=_request_options(timeout),
+            ),
+            kind=f"images_data:{model_name}",
+        )
+        extracted_dict = json.loads(response.text)
+        if not isinstance(extracted_dict, dict):
+            raise ValueError(f"Expected a JSON object, got: {response.text}")
+        print(extracted_dict)
+        extraction_cache.put(cache_key, response.text, extracted_dict)
+    except Exception as e:
+        if not fallback_to_two_step:
+            raise
+        print(f"Single call extraction failed ({e}), falling back to text extraction + parsing.")
+        text = "\n\n".join(get_image_text(image_path, api_key, use_cache) for image_path in image_paths)
+        return get_data_from_text(text, api_key, use_cache, model_name)
+
+    _apply_street_from_cep(extracted_dict)
+    return extracted_dict
+
+
+# A complete "key": value pair in a partial JSON object, where value is a string or a list of strings
+JSON_FIELD_PATTERN = re.compile(
+    r'"((?:[^"\\]|\\.)+)"\s*:\s*("(?:[^"\\]|\\.)*"|\[\s*(?:"(?:[^"\\]|\\.)*"\s*,?\s*)*\])'
+)
+
+
+def stream_data_from_images(image_paths, api_key=None, fallback_to_two_step=True, use_cache=True,
+                            model_name=DEFAULT_MODEL_NAME):
+    """
+    Extract structured data from document images like get_data_from_images, yielding each field
+    as soon as the model has written it.
+    
+    "endereço" may be yielded twice: first as read from the documents, and again at the end
+    with the street registered for the CEP.
+    
+    Args:
+        image_paths (list): Paths to the image files (e.g. a single collage)
+        api_key (str, optional): Google Generative AI API key. If not provided, will use GOOGLE_API_KEY from environment.
+        fallback_to_two_step (bool, optional): Use the two call extraction if streaming fails before
+                                               any field arrived. Defaults to True
+        use_cache (bool, optional): Reuse the response of a previous call with the same images. Defaults to True
+        model_name (str, optional): Model used for the extraction. Defaults to DEFAULT_MODEL_NAME
+        
+    Yields:
+        tuple: (field name, value)
+    """
+    cache_key = _images_data_cache_key(image_paths, model_name)
+    cached = extraction_cache.get(cache_key) if use_cache else None
+    if cached and cached["data"] is not None:
+        extracted_dict = cached["data"]
+        print(extracted_dict)
+        _apply_street_from_cep(extracted_dict)
+        yield from extracted_dict.items()
+        return
+
+    yielded = {}
+    try:
+        model = client_manager.get_model(api_key, model_name)
+        images = [Image.open(image_path) for image_path in image_paths]
+        # Only opening the stream is retried, fields already shown cannot be taken back.
+        # The attempt's deadline also bounds reading the whole stream.
+        response = request_policy.call(
+            lambda timeout: model.generate_content(
+                [*images, IMAGES_DATA_PROMPT],
+                generation_config=genai.GenerationConfig(
+                    response_mime_type="application/json",
+                    response_schema=DATA_RESPONSE_SCHEMA,
+                ),
+                stream=True,
+                request_options=_request_options(timeout),
+            ),
+            kind=f"images_stream:{model_name}",
+            hedge=False,
+        )
+
+        buffer = ""
+        position = 0
+        for chunk in response:
+            buffer += chunk.text
+            for match in JSON_FIELD_PATTERN.finditer(buffer, position):
+                position = match.end()
+                field = json.loads(f'"{match.group(1)}"')
+                value = json.loads(match.group(2))
+                yielded[field] = value
+                yield field, value
+
+        extracted_dict = json.loads(buffer)
+        if not isinstance(extracted_dict, dict):
+            raise ValueError(f"Expected a JSON object, got: {buffer}")
+        print(extracted_dict)
+        extraction_cache.put(cache_key, buffer, extracted_dict)
+    except Exception as e:
+        if not fallback_to_two_step or yielded:
+            raise
+        print(f"Streaming extraction failed ({e}), falling back to text extraction + parsing.")
+        text = "\n\n".join(get_image_text(image_path, api_key, use_cache) for image_path in image_paths)
+        yield from (get_data_from_text(text, api_key, use_cache, model_name) or {}).items()
+        return
+
+    # Fields the pattern did not catch while streaming
+    for field, value in extracted_dict.items():
+        if yielded.get(field) != value:
+            yield field, value
+
+    address = extracted_dict.get("endereço")
+    _apply_street_from_cep(extracted_dict)
+    if extracted_dict.get("endereço") != address:
+        yield "endereço", extracted_dict["endereço"]
+
+
+# Calls and latency per model, and how often the fast model's result had to be escalated
+model_tier_stats = {"requests": 0, "escalations": 0, "models": {}}
+_model_tier_stats_lock = threading.Lock()
+
+
+def _record_tier_call(model_name, seconds, escalated=None):
+    """
+    Update model_tier_stats after a call of the tiered extraction.
+    
+    Args:
+        model_name (str): Model that was called
+        seconds (float): Wall-clock time of the call
+        escalated (bool, optional): For the first tier, whether the result was escalated. Defaults to None
+    """
+    with _model_tier_stats_lock:
+        model_stats = model_tier_stats["models"].setdefault(model_name, {"calls": 0, "total_seconds": 0.0})
+        model_stats["calls"] += 1
+        model_stats["total_seconds"] += seconds
+        if escalated is not None:
+            model_tier_stats["requests"] += 1
+            model_tier_stats["escalations"] += int(escalated)
+
+
+def get_model_tier_stats():
+    """
+    Get the latency per model and the escalation rate of the tiered extraction since the program started.
+    
+    Returns:
+        dict: requests, escalations, escalation_rate (0 to 1) and, per model name, calls and average_seconds
+    """
+    with _model_tier_stats_lock:
+        stats = {
+            "requests": model_tier_stats["requests"],
+            "escalations": model_tier_stats["escalations"],
+            "models": {
+                name: {"calls": model_stats["calls"], "average_seconds": model_stats["total_seconds"] / model_stats["calls"]}
+                for name, model_stats in model_tier_stats["models"].items()
+            },
+        }
+    stats["escalation_rate"] = stats["escalations"] / stats["requests"] if stats["requests"] else 0.0
+    return stats
+
+
+def stream_data_tiered(image_paths, api_key=None, use_cache=True, fast_model_name=FAST_MODEL_NAME,
+                       model_name=DEFAULT_MODEL_NAME, on_escalate=None):
+    """
+    Extract structured data with the fast model first, escalating to the slower model only when the
+    result fails local validation (CPF check digits, dates, CEP, CIDs, required fields).
+    
+    Fields are yielded as they arrive, like stream_data_from_images. When the request is escalated,
+    on_escalate is called first, so the caller can discard the fast model's values, and then the
+    fields are yielded again with the values of the second model.
+    
+    Args:
+        image_paths (list): Paths to the image files (e.g. a single collage)
+        api_key (str, optional): Google Generative AI API key. If not provided, will use GOOGLE_API_KEY from environment.
+        use_cache (bool, optional): Reuse the responses of previous calls. Defaults to True
+        fast_model_name (str, optional): Model tried first. Defaults to FAST_MODEL_NAME
+        model_name (str, optional): Model used when escalating. Defaults to DEFAULT_MODEL_NAME
+        on_escalate (callable, optional): Called with the list of failed checks before escalating. Defaults to None
+        
+    Yields:
+        tuple: (field name, value)
+    """
+    start = time.perf_counter()
+    extracted_dict = {}
+    try:
+        for field, value in stream_data_from_images(image_paths, api_key, False, use_cache, fast_model_name):
+            extracted_dict[field] = value
+            yield field, value
+        problems = validate_extracted_data(extracted_dict) + _missing_fields(extracted_dict)
+    except Exception as e:
+        problems = [f"erro: {e}"]
+    _record_tier_call(fast_model_name, time.perf_counter() - start, escalated=bool(problems))
+
+    if not problems:
+        return
+
+    print(f"{fast_model_name} result failed validation ({', '.join(problems)}), escalating to {model_name}.")
+    if on_escalate is not None:
+        on_escalate(problems)
+    start = time.perf_counter()
+    yield from stream_data_from_images(image_paths, api_key, True, use_cache, model_name)
+    _record_tier_call(model_name, time.perf_counter() - start)
+
+    stats = get_model_tier_stats()
+    print(f"Escalations: {stats['escalations']}/{stats['requests']}")
+
+
+def get_data_tiered(image_paths, api_key=None, use_cache=True, fast_model_name=FAST_MODEL_NAME,
+                    model_name=DEFAULT_MODEL_NAME):
+    """
+    Extract structured data with the fast model first, escalating when needed (see stream_data_tiered).
+    
+    Args:
+        image_paths (list): Paths to the image files (e.g. a single collage)
+        api_key (str, optional): Google Generative AI API key. If not provided, will use GOOGLE_API_KEY from environment.
+        use_cache (bool, optional): Reuse the responses of previous calls. Defaults to True
+        fast_model_name (str, optional): Model tried first. Defaults to FAST_MODEL_NAME
+        model_name (str, optional): Model used when escalating. Defaults to DEFAULT_MODEL_NAME
+        
+    Returns:
+        dict: Dictionary containing extracted user data with the keys in DATA_FIELDS, or None if parsing failed
+    """
+    extracted_dict = {}
+    # The fast model's fields are dropped when escalating, the slower model's answer replaces them
+    for field, value in stream_data_tiered(image_paths, api_key, use_cache, fast_model_name, model_name,
+                                           on_escalate=lambda problems: extracted_dict.clear()):
+        extracted_dict[field] = value
+    return extracted_dict or None
+
+
+def _missing_fields(extracted_dict, required_fields=REQUIRED_FIELDS):
+    """
+    List the required fields that are empty or absent.
+    
+    Args:
+        extracted_dict (dict): Extracted data, or None
+        required_fields (list, optional): Fields to check. Defaults to REQUIRED_FIELDS
+        
+    Returns:
+        list: Names of the missing fields
+    """
+    if not extracted_dict:
+        return list(required_fields)
+    return [field for field in required_fields if not str(extracted_dict.get(field) or "").strip()]
+
+
+def get_data_local_ocr_first(documents, api_key=None, local_engine=None, required_fields=REQUIRED_FIELDS, use_cache=True):
+    """
+    Extract structured data reading each document with a local OCR engine and parsing the text
+    locally (see local_extractor.py), so no request is made when the required fields are found.
+    Otherwise the images are sent to the cloud model in a single call (get_data_from_images).
+    
+    The documents are read one by one, not as a collage: the local extractor can only tell the
+    child's CPF, RG, name and birth date from the responsible person's in a text labelled per document.
+    When the local engine is not available, this is the same as get_data_from_images.
+    
+    Args:
+        documents (dict): Dictionary mapping document names (e.g. "cpf_do_menor") to image paths
+        api_key (str, optional): Google Generative AI API key. If not provided, will use GOOGLE_API_KEY from environment.
+        local_engine (OCREngine, optional): Engine used first. Defaults to TesseractOCREngine()
+        required_fields (list, optional): Fields that must be found to accept the local result. Defaults to REQUIRED_FIELDS
+        use_cache (bool, optional): Reuse the responses of previous cloud calls. Defaults to True
+        
+    Returns:
+        dict: Dictionary containing extracted user data with the keys in DATA_FIELDS, or None if parsing failed
+    """
+    if local_engine is None:
+        local_engine = TesseractOCREngine()
+
+    if local_engine.is_available():
+        try:
+            names = list(documents.keys())
+            texts = [local_engine.get_text(image_path) for image_path in documents.values()]
+            local_fields = extract_fields_locally(_merge_document_texts(names, texts))
+            missing = _missing_fields(local_fields, required_fields)
+            if not missing:
+                print(f"Local OCR ({local_engine.name}) found the required fields, no cloud request.")
+                return _local_only_result(local_fields)
+            print(f"Local OCR ({local_engine.name}) missed {', '.join(missing)}, using the cloud model.")
+        except Exception as e:
+            print(f"Local OCR ({local_engine.name}) failed ({e}), using the cloud model.")
+    else:
+        print(f"Local OCR ({local_engine.name}) not available, using the cloud model.")
+
+    return get_data_from_images(list(documents.values()), api_key, use_cache=use_cache)
+
+
+# Maximum number of CEPs resolved ahead of the parsing for one text
+MAX_PREFETCHED_CEPS = 3
+
+# Runs the CEP lookups that overlap with the model calls
+_cep_executor = ThreadPoolExecutor(max_workers=MAX_PREFETCHED_CEPS, thread_name_prefix="cep")
+
+
+def _prefetch_streets_from_text(text):
+    """
+    Start looking up the streets of the CEPs in a text in the background.
+    
+    Args:
+        text (str): OCR text
+        
+    Returns:
+        dict: Mapping each CEP (8 digits) to the Future of its get_street_from_cep result
+    """
+    return {
+        cep: _cep_executor.submit(get_street_from_cep, cep)
+        for cep in find_ceps_in_text(text)[:MAX_PREFETCHED_CEPS]
+    }
+
+
+def _apply_street_from_cep(extracted_dict, street_lookups=None):
+    """
+    Replace the street in extracted_dict["endereço"] with the one registered for its CEP, keeping the number.
+    
+    Args:
+        extracted_dict (dict): Extracted data, updated in place
+        street_lookups (dict, optional): Lookups already started by _prefetch_streets_from_text
+    """
+    cep = re.sub(r"\D", "", extracted_dict.get("cep", "") or "")
+    if street_lookups and cep in street_lookups:
+        street_cep = street_lookups[cep].result()
+    else:
+        street_cep = get_street_from_cep(cep)
+
+    if street_cep:
+        numero = extracted_dict.get("endereço", "").split(",")[1].strip() if "," in extracted_dict.get("endereço", "") else ""
+        full_address = f"{street_cep}, {numero}".strip(", ")
+        extracted_dict["endereço"] = full_address
+
+
+# SQLite cache of the CEP lookups
+CEP_CACHE_PATH = Path.home() / ".auto_preenchedor_data" / "cep_cache.sqlite3"
+CEP_CACHE_TTL_SECONDS = 90 * 24 * 60 * 60
+# CEPs that do not exist are remembered for less time, in case the provider was missing them
+CEP_NEGATIVE_CACHE_TTL_SECONDS = 24 * 60 * 60
+
+# Errors meaning the CEP does not exist (as opposed to network/provider errors, which are not cached)
+CEP_NOT_FOUND_ERRORS = tuple(
+    getattr(brazilcep_exceptions, name) for name in ("CEPNotFound", "InvalidCEP")
+    if hasattr(brazilcep_exceptions, name)
+)
+
+
+class CepCache:
+    """
+    SQLite cache of CEP to street lookups, with a TTL, that also remembers CEPs that were not found.
+    Safe to use from several threads.
+    """
+    
+    def __init__(self, db_path=CEP_CACHE_PATH, ttl_seconds=CEP_CACHE_TTL_SECONDS,
+                 negative_ttl_seconds=CEP_NEGATIVE_CACHE_TTL_SECONDS):
+        """
+        Initialize the cache. The database is opened on first use.
+        
+        Args:
+            db_path (Path, optional): Path of the SQLite file. Defaults to CEP_CACHE_PATH
+            ttl_seconds (int, optional): How long a found street is valid. Defaults to CEP_CACHE_TTL_SECONDS
+            negative_ttl_seconds (int, optional): How long a not found CEP is remembered. Defaults to CEP_NEGATIVE_CACHE_TTL_SECONDS
+        """
+        self.db_path = Path(db_path)
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._lock = threading.Lock()
+        self._connection = None
+    
+    def _get_connection(self):
+        """Open the database and create the table if needed. Must be called with the lock held."""
+        if self._connection is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS cep_cache ("
+                "cep TEXT PRIMARY KEY, street TEXT, found INTEGER NOT NULL, fetched_at REAL NOT NULL)"
+            )
+            self._connection.commit()
+        return self._connection
+    
+    def get(self, cep):
+        """
+        Look up a CEP in the cache.
+        
+        Args:
+            cep (str): CEP with 8 digits only
+            
+        Returns:
+            tuple: (is_cached, street). street is None for CEPs cached as not found
+        """
+        with self._lock:
+            row = self._get_connection().execute(
+                "SELECT street, found, fetched_at FROM cep_cache WHERE cep = ?", (cep,)
+            ).fetchone()
+        if row is None:
+            return False, None
+        
+        street, found, fetched_at = row
+        ttl_seconds = self.ttl_seconds if found else self.negative_ttl_seconds
+        if time.time() - fetched_at > ttl_seconds:
+            return False, None
+        return True, street if found else None
+    
+    def put(self, cep, street):
+        """
+        Store a lookup result.
+        
+        Args:
+            cep (str): CEP with 8 digits only
+            street (str): Street of the CEP, or None if the CEP does not exist
+        """
+        with self._lock:
+            connection = self._get_connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO cep_cache (cep, street, found, fetched_at) VALUES (?, ?, ?, ?)",
+                (cep, street, street is not None, time.time())
+            )
+            connection.commit()
+
+
+# Shared by every lookup in the process
+cep_cache = CepCache()
+
+
+# Offline CEP index, opened on first use if CEP_INDEX_PATH exists (see cep_index.py)
+_cep_index = None
+_cep_index_checked = False
+_cep_index_lock = threading.Lock()
+
+
+def _get_cep_index():
+    """
+    Open the offline CEP index the first time it is needed.
+    
+    Returns:
+        CepIndex: The index, or None if there is no usable index file
+    """
+    global _cep_index, _cep_index_checked
+    with _cep_index_lock:
+        if not _cep_index_checked:
+            _cep_index_checked = True
+            if CEP_INDEX_PATH.exists():
+                try:
+                    _cep_index = CepIndex(CEP_INDEX_PATH)
+                except (OSError, ValueError) as e:
+                    print(f"Warning: Could not open the CEP index {CEP_INDEX_PATH}: {e}")
+        return _cep_index
+
+
+def get_street_from_cep(cep, use_cache=True):
     """
     Use the brazilcep library to get the street address from a given CEP.
+    The offline CEP index is checked first, if there is one, and online results (including
+    CEPs that do not exist) are kept in a local SQLite cache.
     """
+    cep = re.sub(r"\D", "", cep or "")
+    if len(cep) != 8:
+        print(f"Error fetching street from CEP {cep}: invalid CEP")
+        return None
+    
+    cep_index = _get_cep_index()
+    if cep_index is not None:
+        try:
+            street = cep_index.get_street(cep)
+            if street:
+                return street
+        except Exception as e:
+            # Corrupt index, fall back to the cache and the online lookup
+            print(f"Warning: Could not read the CEP index: {e}")
+    
+    if use_cache:
+        try:
+            is_cached, street = cep_cache.get(cep)
+            if is_cached:
+                return street
+        except sqlite3.Error as e:
+            print(f"Warning: Could not read the CEP cache: {e}")
+    
     try:
-        cep = cep.replace("-", "").strip()
         dados_cep = get_address_from_cep(cep)
-        return dados_cep.get("street", "")
+        street = dados_cep.get("street", "")
+    except CEP_NOT_FOUND_ERRORS as e:
+        print(f"Error fetching street from CEP {cep}: {e}")
+        street = None
     except Exception as e:
+        # Network or provider problem, try again next time
         print(f"Error fetching street from CEP {cep}: {e}")
         return None
+    
+    try:
+        cep_cache.put(cep, street)
+    except sqlite3.Error as e:
+        print(f"Warning: Could not write to the CEP cache: {e}")
+    return street
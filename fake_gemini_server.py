@@ -0,0 +1,217 @@
+"""
+Fake Gemini Server
+Local stand-in for the Gemini REST API, with configurable latency and failures, to try the
+request policy (timeouts, retries, hedging) without spending quota.
+
+Usage:
+    python fake_gemini_server.py [--port 8080] [--latency 2] [--jitter 1] [--error-rate 0.2] [--hang-rate 0.05]
+                                 [--max-concurrent 4]
+
+Then run the program with GEMINI_API_ENDPOINT=http://localhost:8080 (any GOOGLE_API_KEY works).
+Every path goes through it, including the async per-document OCR (see GeminiClientManager.uses_rest).
+"""
+
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+# Answer of the single-document requests: the data fields with example values, valid for both parsing paths
+DEFAULT_RESPONSE_TEXT = json.dumps({
+    "nome_do_responsavel": "MARIA DA SILVA",
+    "nome_do_menor": "JOAO DA SILVA",
+    "nome_da_mae_do_menor": "MARIA DA SILVA",
+    "cpf_do_responsavel": "111.444.777-35",
+    "rg_do_responsavel": "1234567",
+    "cpf_do_menor": "529.982.247-25",
+    "rg_do_menor": "7654321",
+    "data_de_nascimento_do_menor": "01/02/2015",
+    "endereço": "Rua das Flores, 12",
+    "cep": "50000-000",
+    "telefone": "(81) 99999-9999",
+    "email": "maria@example.com",
+    "cids": ["10 F84.0"],
+}, ensure_ascii=False)
+
+# Start of each record of a batch prompt (see BATCH_DATA_PROMPT in data_extractor.py)
+BATCH_RECORD_PATTERN = re.compile(r"<<<REGISTRO (\d+)>>>")
+
+
+def _prompt_text(body):
+    """Join the text parts of a generateContent or countTokens request body, system instruction included."""
+    try:
+        request = json.loads(body or b"{}")
+    except ValueError:
+        return ""
+    contents = [*request.get("contents", []), request.get("systemInstruction") or {}]
+    if "generateContentRequest" in request:
+        contents += request["generateContentRequest"].get("contents", [])
+    return "\n".join(part.get("text", "") for content in contents for part in content.get("parts", []))
+
+
+def _token_count(text):
+    """Fake token count of a text (about 4 characters per token)."""
+    return max(1, len(text) // 4)
+
+
+def _batch_response_text(prompt, response_text):
+    """
+    Answer a batch prompt with one record per <<<REGISTRO n>>> found in it.
+
+    Args:
+        prompt (str): Text of the request
+        response_text (str): Answer of a single document, a JSON object
+
+    Returns:
+        str: A JSON array of the answer tagged with each record number, or None if the prompt is not a batch
+              or the answer is not a JSON object
+    """
+    numbers = BATCH_RECORD_PATTERN.findall(prompt)
+    if not numbers:
+        return None
+    try:
+        record = json.loads(response_text)
+    except ValueError:
+        return None
+    if not isinstance(record, dict):
+        return None
+    return json.dumps([{**record, "registro": int(number)} for number in numbers], ensure_ascii=False)
+
+
+def _candidate(text, prompt_tokens=None):
+    """Build a generateContent response with the given text, and the usage if prompt_tokens is given."""
+    response = {
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+    }
+    if prompt_tokens is not None:
+        response["usageMetadata"] = {"promptTokenCount": prompt_tokens, "candidatesTokenCount": _token_count(text)}
+    return response
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    """
+    Answers models/*:generateContent, models/*:streamGenerateContent and models/*:countTokens.
+    The behaviour is set on the server: latency, jitter, error_rate, hang_rate, max_concurrent and response_text.
+    Batch prompts get response_text once per record, as a JSON array.
+    """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+
+        with server.in_flight_lock:
+            throttled = server.max_concurrent is not None and server.in_flight >= server.max_concurrent
+            if not throttled:
+                server.in_flight += 1
+        if throttled:
+            self._send_json(429, {"error": {"code": 429, "message": "Fake quota exceeded", "status": "RESOURCE_EXHAUSTED"}})
+            return
+        try:
+            self._answer(body)
+        finally:
+            with server.in_flight_lock:
+                server.in_flight -= 1
+
+    def _answer(self, body):
+        """Answer a request that is within the quota."""
+        server = self.server
+
+        if random.random() < server.hang_rate:
+            # Never answer in time, the client must give up on its own
+            time.sleep(600)
+            return
+        time.sleep(max(0, server.latency + random.uniform(-server.jitter, server.jitter)))
+
+        if random.random() < server.error_rate:
+            self._send_json(503, {"error": {"code": 503, "message": "Fake overload", "status": "UNAVAILABLE"}})
+            return
+
+        prompt = _prompt_text(body)
+        text = _batch_response_text(prompt, server.response_text) or server.response_text
+        if ":streamGenerateContent" in self.path:
+            # Split the text in a few chunks, like the real streaming does
+            size = max(1, len(text) // 4)
+            chunks = [_candidate(text[i:i + size]) for i in range(0, len(text), size)]
+            if "alt=sse" in self.path:
+                body = "".join(f"data: {json.dumps(chunk)}\r\n\r\n" for chunk in chunks).encode("utf-8")
+                self._send(200, body, "text/event-stream")
+            else:
+                self._send_json(200, chunks)
+        elif ":generateContent" in self.path:
+            self._send_json(200, _candidate(text, _token_count(prompt)))
+        elif ":countTokens" in self.path:
+            self._send_json(200, {"totalTokens": _token_count(prompt)})
+        else:
+            self._send_json(404, {"error": {"code": 404, "message": f"Unknown path {self.path}", "status": "NOT_FOUND"}})
+
+    def _send_json(self, status, payload):
+        """Send a JSON response."""
+        self._send(status, json.dumps(payload).encode("utf-8"), "application/json")
+
+    def _send(self, status, body, content_type):
+        """Send a response."""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        print(f"{self.command} {self.path.split('?')[0]} -> {args[1] if len(args) > 1 else ''}")
+
+
+def serve(port=8080, latency=1.0, jitter=0.0, error_rate=0.0, hang_rate=0.0, max_concurrent=None,
+          response_text=DEFAULT_RESPONSE_TEXT):
+    """
+    Run the fake server until interrupted.
+
+    Args:
+        port (int, optional): Port to listen on. Defaults to 8080
+        latency (float, optional): Seconds before each answer. Defaults to 1.0
+        jitter (float, optional): Random variation of the latency, in seconds. Defaults to 0.0
+        error_rate (float, optional): Fraction of requests answered with a 503 error. Defaults to 0.0
+        hang_rate (float, optional): Fraction of requests never answered. Defaults to 0.0
+        max_concurrent (int, optional): Requests in flight above which 429 is answered. Defaults to None (no quota)
+        response_text (str, optional): Text of the answers. Defaults to DEFAULT_RESPONSE_TEXT
+    """
+    server = ThreadingHTTPServer(("localhost", port), FakeGeminiHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.jitter = jitter
+    server.error_rate = error_rate
+    server.hang_rate = hang_rate
+    server.max_concurrent = max_concurrent
+    server.in_flight = 0
+    server.in_flight_lock = threading.Lock()
+    server.response_text = response_text
+
+    print(f"Fake Gemini server on http://localhost:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    """Parse the command line and run the server."""
+    parser = argparse.ArgumentParser(description="Local fake of the Gemini REST API.")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=1.0, help="Seconds before each answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random variation of the latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Fraction of requests never answered")
+    parser.add_argument("--max-concurrent", type=int, default=None, help="Requests in flight above which 429 is answered")
+    parser.add_argument("--response-text", default=DEFAULT_RESPONSE_TEXT, help="Text of the answers")
+    args = parser.parse_args()
+
+    serve(args.port, args.latency, args.jitter, args.error_rate, args.hang_rate, args.max_concurrent, args.response_text)
+
+
+if __name__ == "__main__":
+    main()
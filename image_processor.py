@@ -4,38 +4,299 @@ Handles image file organization, PDF conversion, and collage creation.
 """
 
 import os
+import sys
+import json
+import shutil
+import hashlib
+from io import BytesIO
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pathlib import Path
-from PIL import Image
+from PIL import Image, ImageOps
 import img2pdf
 import unidecode
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
 
 # User data folder path
 DATA_DIR = Path.home() / ".auto_preenchedor_data"
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def organize_image_files(image_paths_dict, folder_name):
+# Linux ioctl that makes dest share the extents of src (copy-on-write clone, e.g. Btrfs/XFS).
+# The number means something else on other systems that have fcntl, e.g. macOS.
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+IS_LINUX = sys.platform.startswith("linux")
+
+# Default byte budget for images sent to the AI (keeps upload time predictable on slow links)
+UPLOAD_MAX_BYTES = 1_500_000
+
+# Below this quality JPEG/WebP artifacts start to blur small document text
+MIN_UPLOAD_QUALITY = 40
+
+# Default limits for the PDFs attached to the web forms
+PDF_MAX_DPI = 150
+PDF_MAX_BYTES = 1_000_000
+
+# PDF pages are sized as A4, so the DPI limit caps the long side at this many inches
+A4_LONG_SIDE_INCHES = 11.69
+
+# Name of the per-case manifest recording which source produced each organized file
+MANIFEST_FILE_NAME = ".manifest.json"
+
+# Documents that also need a PDF version for the web forms
+IMAGE_NAMES_TO_CONVERT_TO_PDF = [
+    "cpf_do_responsavel",
+    "rg_do_responsavel",
+    "cpf_do_menor",
+    "rg_do_menor",
+    "laudo_medico",
+    "comprovante_residencia",
+]
+
+
+def _copy_file(src_path, dest_path, allow_hardlink=False):
+    """
+    Copy a single file to dest_path without loading it whole into memory.
+    
+    Tries, in order: a hard link (only if allowed), on Linux a reflink clone and kernel-side
+    copy_file_range, and finally shutil.copyfile (sendfile on Linux, fcopyfile on macOS, chunked copy elsewhere).
+    
+    Args:
+        src_path (str): Path to the source file
+        dest_path (str): Path where the copy should be written
+        allow_hardlink (bool, optional): Link dest_path to the source instead of copying when
+                                         both are on the same filesystem. Defaults to False
+    """
+    if os.path.lexists(dest_path):
+        os.remove(dest_path)
+
+    if allow_hardlink:
+        try:
+            os.link(src_path, dest_path)
+            return
+        except OSError:
+            pass  # Different filesystem or not supported, copy instead
+
+    if IS_LINUX:
+        with open(src_path, "rb") as src_file, open(dest_path, "wb") as dest_file:
+            if fcntl is not None:
+                try:
+                    fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+                    return
+                except OSError:
+                    pass
+
+            if hasattr(os, "copy_file_range"):
+                try:
+                    remaining = os.fstat(src_file.fileno()).st_size
+                    while remaining > 0:
+                        copied = os.copy_file_range(src_file.fileno(), dest_file.fileno(), remaining)
+                        if copied == 0:
+                            break
+                        remaining -= copied
+                    if remaining == 0:
+                        return
+                except OSError:
+                    pass
+
+    # Rewrites dest_path from the start, so a partial copy above does not matter
+    shutil.copyfile(src_path, dest_path)
+
+
+def _image_bytes_for_pdf(image_path, max_dpi=None, max_bytes=None):
+    """
+    Downsample and re-encode an image as a JPEG suited to be embedded in a PDF.
+    
+    Args:
+        image_path (str): Path to the source image
+        max_dpi (int, optional): Maximum resolution for an A4 page. Defaults to None (keep the resolution)
+        max_bytes (int, optional): Maximum JPEG size in bytes. Defaults to None (fixed quality 85)
+        
+    Returns:
+        bytes: The encoded JPEG
+    """
+    with Image.open(image_path) as img:
+        # The EXIF orientation tag is lost when re-encoding, so apply it to the pixels
+        img = ImageOps.exif_transpose(img)
+        if max_dpi:
+            max_long_side = int(A4_LONG_SIDE_INCHES * max_dpi)
+            img.thumbnail((max_long_side, max_long_side), Image.Resampling.LANCZOS)
+        if max_bytes:
+            data, _ = _encode_within_budget(img, max_bytes)
+            return data
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        return _encode(img, "JPEG", 85)
+
+
+def _write_pdf(image_path, pdf_path, max_dpi=None, max_bytes=None):
+    """
+    Encode an image as a PDF file. Kept at module level so it can run in a worker process.
+    
+    Args:
+        image_path (str): Path to the source image
+        pdf_path (str): Path where the PDF should be saved
+        max_dpi (int, optional): Downsample the image to at most this resolution on an A4 page.
+                                 Defaults to None (embed the original image)
+        max_bytes (int, optional): Re-encode the image to at most this many bytes.
+                                   Defaults to None (embed the original image)
+        
+    Returns:
+        dict: Sizes in bytes, with the keys original_bytes and pdf_bytes
+    """
+    original_bytes = os.path.getsize(image_path)
+    pdf_data = None
+    if max_dpi or max_bytes:
+        image_data = _image_bytes_for_pdf(image_path, max_dpi, max_bytes)
+        # Only worth it if it actually got smaller than the original file
+        if len(image_data) < original_bytes:
+            layout_fun = img2pdf.get_fixed_dpi_layout_fun((max_dpi, max_dpi)) if max_dpi else None
+            pdf_data = img2pdf.convert(image_data, layout_fun=layout_fun) if layout_fun else img2pdf.convert(image_data)
+    if pdf_data is None:
+        pdf_data = img2pdf.convert(str(image_path))
+
+    # Duplicates are hard links to this PDF, so it is replaced instead of rewritten in place
+    pdf_path = Path(pdf_path)
+    temp_path = pdf_path.with_suffix(f"{pdf_path.suffix}.{os.getpid()}.tmp")
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(pdf_data)
+        os.replace(temp_path, pdf_path)
+    finally:
+        temp_path.unlink(missing_ok=True)
+    return {"original_bytes": original_bytes, "pdf_bytes": len(pdf_data)}
+
+
+def _print_pdf_report(pdf_path, report):
+    """
+    Print how many bytes a PDF saved compared to its source image.
+    
+    Args:
+        pdf_path (str): Path of the PDF
+        report (dict): Sizes returned by _write_pdf
+    """
+    saved = report["original_bytes"] - report["pdf_bytes"]
+    print(f"PDF {Path(pdf_path).name}: {report['original_bytes'] / 1024:.0f} KB -> "
+          f"{report['pdf_bytes'] / 1024:.0f} KB ({saved / 1024:.0f} KB saved)")
+
+
+def _file_hash(file_path, chunk_size=1024 * 1024):
+    """
+    Compute the SHA-256 hash of a file's content, reading it in chunks.
+    
+    Args:
+        file_path (str): Path to the file
+        chunk_size (int, optional): Number of bytes read per chunk. Defaults to 1 MB
+        
+    Returns:
+        str: Hex digest of the file content
+    """
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _load_manifest(folder_path):
+    """
+    Load the manifest of a case folder.
+    
+    Args:
+        folder_path (Path): Case folder
+        
+    Returns:
+        dict: The manifest, or None if the folder has no readable manifest
+    """
+    manifest_path = folder_path / MANIFEST_FILE_NAME
+    if not manifest_path.exists():
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not read manifest {manifest_path}: {e}")
+        return None
+
+
+def _save_manifest(folder_path, manifest):
+    """
+    Save the manifest of a case folder.
+    
+    Args:
+        folder_path (Path): Case folder
+        manifest (dict): Manifest to save
+    """
+    with open(folder_path / MANIFEST_FILE_NAME, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def _is_entry_current(entry, image_path, size, mtime, dest_image_path, pdf_path, pdf_options):
+    """
+    Check if a manifest entry still matches the source image and its organized files.
+    
+    Args:
+        entry (dict): Manifest entry from the previous run, or None
+        image_path (str): Path to the source image
+        size (int): Current size of the source image
+        mtime (float): Current modification time of the source image
+        dest_image_path (Path): Where the organized copy should be
+        pdf_path (Path): Where the PDF should be, or None if no PDF is needed
+        pdf_options (list): [max_dpi, max_bytes] used to generate the PDF
+        
+    Returns:
+        tuple: (is_current, content_hash)
+    """
+    if not entry or entry.get("file") != str(dest_image_path) or entry.get("pdf") != (str(pdf_path) if pdf_path else None):
+        return False, _file_hash(image_path)
+    if pdf_path and entry.get("pdf_options") != pdf_options:
+        return False, _file_hash(image_path)
+    if not dest_image_path.exists() or (pdf_path and not pdf_path.exists()):
+        return False, _file_hash(image_path)
+
+    # Same path, size and mtime: trust the stored hash instead of reading the file again
+    if entry.get("source") == str(image_path) and entry.get("size") == size and entry.get("mtime") == mtime:
+        return True, entry["hash"]
+
+    content_hash = _file_hash(image_path)
+    return content_hash == entry.get("hash"), content_hash
+
+
+def organize_image_files(image_paths_dict, folder_name, parallel=False, max_workers=None, allow_hardlink=False,
+                         pdf_max_dpi=None, pdf_max_bytes=None):
     """
     Make a copy of the images in image_paths_dict into the user's .auto_preenchedor_data folder,
     and create PDF files from them.
     
+    Files whose source content did not change since the last call for the same folder
+    (according to the folder's manifest) are neither copied nor converted again. Documents with
+    identical content (e.g. one photo used for both CPF and RG) are stored and converted once,
+    and the other names are hard links to the same files.
+    
     Args:
         image_paths_dict (dict): Dictionary mapping image names to their file paths
         folder_name (str): Name of the folder to organize files into
+        parallel (bool, optional): Copy the files in a thread pool and encode the PDFs in a
+                                   process pool instead of one after another. Defaults to False
+        max_workers (int, optional): Number of workers for each pool when parallel is True.
+                                     Defaults to the number of CPUs
+        allow_hardlink (bool, optional): Hard link the organized images to the originals when they are
+                                         on the same filesystem instead of copying them. Edits to the
+                                         originals then also change the organized copies. Defaults to False
+        pdf_max_dpi (int, optional): Downsample the images embedded in the PDFs to this resolution
+                                     (for an A4 page). Defaults to None (embed the original image)
+        pdf_max_bytes (int, optional): Re-encode the images embedded in the PDFs to at most this many
+                                       bytes. Defaults to None (embed the original image)
         
     Returns:
         dict: Dictionary mapping image names to their new organized paths
     """
     organized_image_paths = {}
-    image_names_to_convert_to_pdf = [
-        "cpf_do_responsavel",
-        "rg_do_responsavel",
-        "cpf_do_menor",
-        "rg_do_menor",
-        "laudo_medico",
-        "comprovante_residencia",
-    ]
 
     # Clean the folder_name first, removing any bad characters from it and converting spaces to underscores
     folder_name = unidecode.unidecode(folder_name)
@@ -45,36 +306,274 @@ def organize_image_files(image_paths_dict, folder_name):
     folder_to_save = DATA_DIR / folder_name
     folder_to_save.mkdir(parents=True, exist_ok=True)
 
-    # Clean up existing files in the folder
-    for already_existing_file in folder_to_save.iterdir():
-        already_existing_file.unlink()
+    old_manifest = _load_manifest(folder_to_save)
+    if old_manifest is None:
+        # Unknown folder content, clean up everything like a fresh case
+        for already_existing_file in folder_to_save.iterdir():
+            if already_existing_file.is_file():
+                already_existing_file.unlink()
+        old_manifest = {}
 
+    pdf_options = [pdf_max_dpi, pdf_max_bytes]
+    write_pdf = partial(_write_pdf, max_dpi=pdf_max_dpi, max_bytes=pdf_max_bytes)
+
+    new_manifest = {}
+    copy_jobs = []
+    pdf_jobs = []
+    image_link_jobs = []
+    pdf_link_jobs = []
+    # First organized (image, pdf) paths of each content hash, shared by the duplicates
+    stored_by_hash = {}
     for image_name, image_path in image_paths_dict.items():
         if not os.path.isfile(image_path):
             print(f"Warning: File {image_path} does not exist. Skipping.")
             continue
 
-        # Copy image to folder_to_save
         dest_image_path = folder_to_save / f"{image_name}{os.path.splitext(image_path)[1]}"
-        with open(image_path, "rb") as src_file:
-            with open(dest_image_path, "wb") as dest_file:
-                dest_file.write(src_file.read())
-
         organized_image_paths[image_name] = str(dest_image_path)
 
         # Convert specific images to PDF
-        if image_name in image_names_to_convert_to_pdf:
+        pdf_path = None
+        if image_name in IMAGE_NAMES_TO_CONVERT_TO_PDF:
             pdf_path = dest_image_path.with_suffix(".pdf")
-            with open(pdf_path, "wb") as f:
-                f.write(img2pdf.convert(str(dest_image_path)))
             organized_image_paths[f"{image_name}_pdf"] = str(pdf_path)
 
+        stat = os.stat(image_path)
+        is_current, content_hash = _is_entry_current(
+            old_manifest.get(image_name), image_path, stat.st_size, stat.st_mtime, dest_image_path, pdf_path, pdf_options
+        )
+        new_manifest[image_name] = {
+            "source": str(image_path),
+            "hash": content_hash,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "file": str(dest_image_path),
+            "pdf": str(pdf_path) if pdf_path else None,
+            "pdf_options": pdf_options,
+        }
+
+        stored = stored_by_hash.setdefault(content_hash, {"file": dest_image_path, "pdf": pdf_path})
+        is_duplicate = stored["file"] != dest_image_path
+        if is_duplicate and pdf_path and stored["pdf"] is None:
+            # First copy of this content that needs a PDF, the next duplicates can share it
+            stored["pdf"] = pdf_path
+
+        if is_current:
+            continue
+
+        if is_duplicate:
+            image_link_jobs.append((stored["file"], dest_image_path))
+            if pdf_path and stored["pdf"] != pdf_path:
+                pdf_link_jobs.append((stored["pdf"], pdf_path))
+            elif pdf_path:
+                pdf_jobs.append((dest_image_path, pdf_path))
+            continue
+
+        copy_jobs.append((image_path, dest_image_path))
+        if pdf_path:
+            pdf_jobs.append((dest_image_path, pdf_path))
+
+    # Remove only the files of the previous run that are no longer produced
+    files_to_keep = {path for entry in new_manifest.values() for path in (entry["file"], entry["pdf"]) if path}
+    for entry in old_manifest.values():
+        for stale_path in (entry.get("file"), entry.get("pdf")):
+            if stale_path and stale_path not in files_to_keep and os.path.isfile(stale_path):
+                os.remove(stale_path)
+
+    # Drop the manifest while files are being rewritten, so an interrupted run is never trusted
+    (folder_to_save / MANIFEST_FILE_NAME).unlink(missing_ok=True)
+
+    copy_file = partial(_copy_file, allow_hardlink=allow_hardlink)
+    # Duplicates live in the same folder, so they can always be linked (copied only if links are not supported)
+    link_file = partial(_copy_file, allow_hardlink=True)
+
+    if not parallel:
+        for src_path, dest_path in copy_jobs:
+            copy_file(src_path, dest_path)
+        for src_path, dest_path in image_link_jobs:
+            link_file(src_path, dest_path)
+        for image_path, pdf_path in pdf_jobs:
+            report = write_pdf(image_path, pdf_path)
+            if pdf_max_dpi or pdf_max_bytes:
+                _print_pdf_report(pdf_path, report)
+        for src_path, dest_path in pdf_link_jobs:
+            link_file(src_path, dest_path)
+        _save_manifest(folder_to_save, new_manifest)
+        return organized_image_paths
+
+    # Copies are I/O bound, so threads are enough; PDF encoding is CPU bound and goes to processes.
+    # The PDFs read the copied images, so all copies must finish before the encoding starts.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(lambda job: copy_file(*job), copy_jobs))
+    for src_path, dest_path in image_link_jobs:
+        link_file(src_path, dest_path)
+
+    if pdf_jobs:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(write_pdf, str(image_path), str(pdf_path)) for image_path, pdf_path in pdf_jobs]
+            for (_, pdf_path), future in zip(pdf_jobs, futures):
+                report = future.result()
+                if pdf_max_dpi or pdf_max_bytes:
+                    _print_pdf_report(pdf_path, report)
+    for src_path, dest_path in pdf_link_jobs:
+        link_file(src_path, dest_path)
+
+    _save_manifest(folder_to_save, new_manifest)
     return organized_image_paths
 
 
-def create_image_collage(image_paths, output_path, rows, cols, image_size=(200, 200)):
+def deduplicate_image_paths(image_paths):
+    """
+    Remove images with the same content from a list, keeping the first occurrence.
+    
+    Args:
+        image_paths (list): A list of file paths to the images
+        
+    Returns:
+        list: The image paths with each distinct content only once, in the original order
+    """
+    unique_paths = []
+    seen_hashes = set()
+    for image_path in image_paths:
+        try:
+            content_hash = _file_hash(image_path)
+        except OSError:
+            # Let the collage builder report the missing file
+            unique_paths.append(image_path)
+            continue
+        if content_hash not in seen_hashes:
+            seen_hashes.add(content_hash)
+            unique_paths.append(image_path)
+    return unique_paths
+
+
+def _open_resized(image_path, target_size, fast_decode=True):
+    """
+    Open an image and resize it to target_size.
+    
+    With fast_decode, JPEGs are decoded directly at a reduced scale (draft mode) and other formats
+    are shrunk by an integer factor (reduce) before the final LANCZOS resize, so the full
+    resolution pixels are never produced just to be thrown away.
+    
+    Args:
+        image_path (str): Path to the image
+        target_size (tuple): Final (width, height)
+        fast_decode (bool, optional): Use decoder-level downscaling. Defaults to True
+        
+    Returns:
+        Image: The resized image
+    """
+    with Image.open(image_path) as img:
+        if not fast_decode:
+            return img.resize(target_size, Image.Resampling.LANCZOS)
+
+        # Only JPEG supports draft; it picks the smallest DCT scale that is still >= target_size,
+        # which leaves the image between 1x and 2x the target
+        img.draft("RGB", target_size)
+        # reducing_gap makes resize() first reduce() by an integer factor while keeping at least 3x
+        # the target size for the LANCZOS pass, so the text stays sharp. After draft that almost never
+        # applies; it is what shrinks the formats without draft (PNG, WebP, ...)
+        return img.resize(target_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+
+def _read_image_headers(image_paths):
+    """
+    Read the size and format of each image without decoding its pixels.
+    
+    Args:
+        image_paths (list): A list of file paths to the images
+        
+    Returns:
+        list: List of (image_path, (width, height), format) for the images that could be opened
+    """
+    headers = []
+    for image_path in image_paths:
+        try:
+            with Image.open(image_path) as img:
+                headers.append((image_path, img.size, img.format))
+        except FileNotFoundError:
+            print(f"Error: Image not found at {image_path}. Skipping.")
+        except Exception as e:
+            print(f"Error processing image {image_path}: {e}. Skipping.")
+    return headers
+
+
+def _estimate_paste_bytes(image_size, image_format, target_size, fast_decode):
+    """
+    Estimate the memory needed to decode one image and resize it to target_size.
+    
+    Args:
+        image_size (tuple): Original (width, height)
+        image_format (str): Pillow format name of the image
+        target_size (tuple): Size the image is resized to
+        fast_decode (bool): Whether decoder-level downscaling is used
+        
+    Returns:
+        int: Estimated peak bytes for this image
+    """
+    width, height = image_size
+    if fast_decode and image_format == "JPEG":
+        # Draft mode decodes at 1/2, 1/4 or 1/8 scale, as long as the result is still >= target_size
+        scale = 1
+        while scale < 8 and width // (scale * 2) >= target_size[0] and height // (scale * 2) >= target_size[1]:
+            scale *= 2
+        width, height = width // scale, height // scale
+    # Decoded source, plus the intermediate reduce() result and the resized output
+    return width * height * 3 + 2 * target_size[0] * target_size[1] * 3
+
+
+def _scale_for_memory_cap(estimate_bytes, max_memory_mb, min_scale=0.25):
+    """
+    Find how much a collage has to be scaled down to fit in a memory cap.
+    
+    Args:
+        estimate_bytes (callable): Function returning the estimated peak bytes for a given scale
+        max_memory_mb (float): Memory cap in MB, or None for no cap
+        min_scale (float, optional): Smallest scale allowed. Defaults to 0.25
+        
+    Returns:
+        float: Scale between min_scale and 1.0
+    """
+    if not max_memory_mb:
+        return 1.0
+
+    scale = 1.0
+    while estimate_bytes(scale) > max_memory_mb * 1024 * 1024 and scale > min_scale:
+        scale = max(min_scale, scale * 0.9)
+
+    if estimate_bytes(scale) > max_memory_mb * 1024 * 1024:
+        print(f"Warning: The collage needs more than {max_memory_mb} MB even at {min_scale:.0%} of its size.")
+    elif scale < 1.0:
+        print(f"Collage scaled to {scale:.0%} of its size to stay within {max_memory_mb} MB.")
+    return scale
+
+
+def _paste_resized(collage, image_path, position, target_size, fast_decode):
+    """
+    Decode, resize and paste one image, releasing its buffers before returning.
+    
+    Args:
+        collage (Image): Canvas to paste onto
+        image_path (str): Path to the image
+        position (tuple): (x, y) of the top left corner on the canvas
+        target_size (tuple): Size to resize the image to
+        fast_decode (bool): Use decoder-level downscaling
+    """
+    img = _open_resized(image_path, target_size, fast_decode)
+    try:
+        collage.paste(img, position)
+    finally:
+        img.close()
+        del img
+
+
+def create_image_collage(image_paths, output_path, rows, cols, image_size=(200, 200), fast_decode=True,
+                         max_bytes=None, max_memory_mb=None, **encode_options):
     """
     Creates a collage from a list of image paths.
+    
+    Images are decoded, resized and pasted one at a time, and each one is released before the next
+    is opened, so besides the canvas only one source image is in memory at any time.
 
     Args:
         image_paths (list): A list of file paths to the images
@@ -83,12 +582,37 @@ def create_image_collage(image_paths, output_path, rows, cols, image_size=(200,
         cols (int): The number of columns in the collage grid
         image_size (tuple, optional): The target size (width, height) for each image in the collage.
                                       Defaults to (200, 200)
+        fast_decode (bool, optional): Decode the images at reduced resolution before resizing them.
+                                      Defaults to True
+        max_bytes (int, optional): Byte budget for the saved file, see save_image_within_budget.
+                                   Defaults to None (no budget)
+        max_memory_mb (float, optional): Peak memory cap in MB. The cells are shrunk until the estimated
+                                         peak fits. Defaults to None (no cap)
+        **encode_options: Extra arguments for save_image_within_budget (image_format, grayscale, ...)
+        
+    Returns:
+        dict: Encoding report with the keys bytes, quality, format and size, or None if saving failed
     """
     if len(image_paths) != rows * cols:
         print("Warning: The number of images does not match the specified grid dimensions.")
         # This implementation will leave blank spaces if there are fewer images
         # or ignore extra images if there are more.
 
+    if max_memory_mb:
+        headers = _read_image_headers(image_paths[:rows * cols])
+
+        def estimate_bytes(scale):
+            cell_size = (int(image_size[0] * scale), int(image_size[1] * scale))
+            canvas_bytes = cols * cell_size[0] * rows * cell_size[1] * 3
+            paste_bytes = max(
+                (_estimate_paste_bytes(size, image_format, cell_size, fast_decode) for _, size, image_format in headers),
+                default=0
+            )
+            return canvas_bytes + paste_bytes
+
+        scale = _scale_for_memory_cap(estimate_bytes, max_memory_mb)
+        image_size = (int(image_size[0] * scale), int(image_size[1] * scale))
+
     # Calculate collage dimensions
     collage_width = cols * image_size[0]
     collage_height = rows * image_size[1]
@@ -106,12 +630,8 @@ def create_image_collage(image_paths, output_path, rows, cols, image_size=(200,
                 y_offset = r * image_size[1]
 
                 try:
-                    # Open and resize the image
-                    img = Image.open(image_paths[image_index])
-                    img = img.resize(image_size, Image.Resampling.LANCZOS)  # Use a high-quality resizer
-                    
-                    # Paste the image onto the collage
-                    collage.paste(img, (x_offset, y_offset))
+                    # Open, resize and paste the image
+                    _paste_resized(collage, image_paths[image_index], (x_offset, y_offset), image_size, fast_decode)
 
                 except FileNotFoundError:
                     print(f"Error: Image not found at {image_paths[image_index]}. Skipping.")
@@ -121,35 +641,296 @@ def create_image_collage(image_paths, output_path, rows, cols, image_size=(200,
                 image_index += 1
 
     # Save the final collage
+    return _save_collage(collage, output_path, max_bytes, **encode_options)
+
+
+def _split_into_rows(aspect_ratios, num_rows):
+    """
+    Split a sequence of aspect ratios into contiguous rows with similar total aspect ratio.
+    
+    Args:
+        aspect_ratios (list): Width/height ratio of each image, in collage order
+        num_rows (int): Number of rows to create
+        
+    Returns:
+        list: List of (start, end) index pairs, one per row
+    """
+    cumulative = [0.0]
+    for aspect_ratio in aspect_ratios:
+        cumulative.append(cumulative[-1] + aspect_ratio)
+    total = cumulative[-1]
+
+    boundaries = [0]
+    for row in range(1, num_rows):
+        target = row * total / num_rows
+        # Each row needs at least one image, before and after this boundary
+        candidates = range(boundaries[-1] + 1, len(aspect_ratios) - (num_rows - row) + 1)
+        boundaries.append(min(candidates, key=lambda i: abs(cumulative[i] - target)))
+    boundaries.append(len(aspect_ratios))
+
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def compute_packed_layout(image_sizes, target_long_edge=3000):
+    """
+    Compute a collage layout that keeps the aspect ratio of every image and leaves no empty space.
+    
+    Images are placed in rows, in order. Each row is scaled so that all rows have the same width,
+    and the number of rows is chosen so the smallest side of the smallest image is as large as
+    possible once the canvas is scaled to target_long_edge.
+    
+    Args:
+        image_sizes (list): List of (width, height) of each image
+        target_long_edge (int, optional): Length of the longest side of the canvas. Defaults to 3000
+        
+    Returns:
+        tuple: (canvas_size, boxes), where canvas_size is (width, height) and boxes is a list
+               with one (x, y, width, height) box per image
+    """
+    if not image_sizes:
+        return (0, 0), []
+
+    aspect_ratios = [width / height for width, height in image_sizes]
+
+    best = None
+    for num_rows in range(1, len(aspect_ratios) + 1):
+        rows = _split_into_rows(aspect_ratios, num_rows)
+
+        # With a canvas width of 1, a row is as tall as 1 / (sum of its aspect ratios)
+        row_heights = [1 / sum(aspect_ratios[start:end]) for start, end in rows]
+        canvas_height = sum(row_heights)
+        scale = target_long_edge / max(1.0, canvas_height)
+
+        smallest_side = min(
+            min(aspect_ratios[i], 1.0) * row_height * scale
+            for (start, end), row_height in zip(rows, row_heights)
+            for i in range(start, end)
+        )
+        if best is None or smallest_side > best[0]:
+            best = (smallest_side, rows, row_heights, scale)
+
+    _, rows, row_heights, scale = best
+
+    # Round cumulative positions so the boxes tile the canvas without gaps
+    boxes = []
+    y = 0.0
+    for (start, end), row_height in zip(rows, row_heights):
+        y0, y1 = round(y * scale), round((y + row_height) * scale)
+        x = 0.0
+        for i in range(start, end):
+            x0, x1 = round(x * scale), round((x + aspect_ratios[i] * row_height) * scale)
+            boxes.append((x0, y0, x1 - x0, y1 - y0))
+            x += aspect_ratios[i] * row_height
+        y += row_height
+
+    canvas_size = (round(scale), round(y * scale))
+    return canvas_size, boxes
+
+
+def create_packed_collage(image_paths, output_path, target_long_edge=3000, spacing=10, fast_decode=True,
+                          max_bytes=None, max_memory_mb=None, **encode_options):
+    """
+    Creates a collage that keeps each image's aspect ratio, packed into a canvas with no empty space.
+    
+    Images are decoded, resized and pasted one at a time, like in create_image_collage.
+    
+    Args:
+        image_paths (list): A list of file paths to the images
+        output_path (str): The path to save the resulting collage image
+        target_long_edge (int, optional): Length of the longest side of the collage. Defaults to 3000
+        spacing (int, optional): White space in pixels between neighbouring images. Defaults to 10
+        fast_decode (bool, optional): Decode the images at reduced resolution before resizing them.
+                                      Defaults to True
+        max_bytes (int, optional): Byte budget for the saved file, see save_image_within_budget.
+                                   Defaults to None (no budget)
+        max_memory_mb (float, optional): Peak memory cap in MB. target_long_edge is reduced until the
+                                         estimated peak fits. Defaults to None (no cap)
+        **encode_options: Extra arguments for save_image_within_budget (image_format, grayscale, ...)
+        
+    Returns:
+        dict: Encoding report with the keys bytes, quality, format and size, or None if no collage was saved
+    """
+    # Only the headers are read here, the pixels are decoded when pasting
+    headers = _read_image_headers(image_paths)
+    image_sizes = [size for _, size, _ in headers]
+
+    def estimate_bytes(scale):
+        canvas_size, boxes = compute_packed_layout(image_sizes, int(target_long_edge * scale))
+        paste_bytes = max(
+            (_estimate_paste_bytes(size, image_format, box[2:], fast_decode)
+             for (_, size, image_format), box in zip(headers, boxes)),
+            default=0
+        )
+        return canvas_size[0] * canvas_size[1] * 3 + paste_bytes
+
+    target_long_edge = int(target_long_edge * _scale_for_memory_cap(estimate_bytes, max_memory_mb))
+
+    canvas_size, boxes = compute_packed_layout(image_sizes, target_long_edge)
+    if not boxes:
+        print("Error: No readable images to create the collage.")
+        return None
+
+    collage = Image.new('RGB', canvas_size, color='white')
+
+    margin = spacing // 2
+    for (image_path, _, _), (x, y, width, height) in zip(headers, boxes):
+        cell_size = (max(1, width - spacing), max(1, height - spacing))
+        try:
+            _paste_resized(collage, image_path, (x + margin, y + margin), cell_size, fast_decode)
+        except Exception as e:
+            print(f"Error processing image {image_path}: {e}. Skipping.")
+
+    # Save the final collage
+    return _save_collage(collage, output_path, max_bytes, **encode_options)
+
+
+def _encode(image, image_format, quality):
+    """
+    Encode an image in memory.
+    
+    Args:
+        image (Image): Image to encode
+        image_format (str): "JPEG" or "WEBP"
+        quality (int): Encoder quality, 1-100
+        
+    Returns:
+        bytes: The encoded image
+    """
+    buffer = BytesIO()
+    if image_format == "JPEG":
+        # 4:2:0 chroma subsampling: colour detail is not needed to read text
+        image.save(buffer, "JPEG", quality=quality, subsampling=2, optimize=True)
+    else:
+        image.save(buffer, image_format, quality=quality, method=4)
+    return buffer.getvalue()
+
+
+def _encode_within_budget(image, max_bytes, image_format="JPEG", grayscale=False,
+                          min_quality=MIN_UPLOAD_QUALITY, max_quality=95):
+    """
+    Encode an image in memory using the highest quality that fits in a byte budget.
+    See save_image_within_budget for the arguments.
+    
+    Returns:
+        tuple: (encoded bytes, report dict with the keys bytes, quality, format and size)
+    """
+    # convert() always copies, so only call it when the mode really changes
+    target_mode = "L" if grayscale else "RGB"
+    if image.mode != target_mode:
+        image = image.convert(target_mode)
+
+    while True:
+        data = _encode(image, image_format, min_quality)
+        if len(data) <= max_bytes or max(image.size) <= 1000:
+            break
+        new_size = (int(image.width * 0.85), int(image.height * 0.85))
+        image = image.resize(new_size, Image.Resampling.LANCZOS)
+
+    quality = min_quality
+    low, high = min_quality + 1, max_quality
+    while low <= high:
+        middle = (low + high) // 2
+        candidate = _encode(image, image_format, middle)
+        if len(candidate) <= max_bytes:
+            data, quality = candidate, middle
+            low = middle + 1
+        else:
+            high = middle - 1
+
+    return data, {"bytes": len(data), "quality": quality, "format": image_format, "size": image.size}
+
+
+def save_image_within_budget(image, output_path, max_bytes=UPLOAD_MAX_BYTES, image_format="JPEG",
+                             grayscale=False, min_quality=MIN_UPLOAD_QUALITY, max_quality=95):
+    """
+    Save an image using the highest quality that fits in a byte budget.
+    
+    The quality is binary searched between min_quality and max_quality. If the image does not fit even
+    at min_quality, it is downscaled in steps of 15% until it does (never below 1000 px on the long side).
+    The file is written in image_format regardless of the extension of output_path.
+    
+    Args:
+        image (Image): Image to save
+        output_path (str): The path to save the image
+        max_bytes (int, optional): Maximum file size in bytes. Defaults to UPLOAD_MAX_BYTES
+        image_format (str, optional): "JPEG" or "WEBP". Defaults to "JPEG"
+        grayscale (bool, optional): Convert to grayscale before encoding. Defaults to False
+        min_quality (int, optional): Lowest quality allowed. Defaults to MIN_UPLOAD_QUALITY
+        max_quality (int, optional): Highest quality tried. Defaults to 95
+        
+    Returns:
+        dict: Encoding report with the keys bytes, quality, format and size
+    """
+    data, report = _encode_within_budget(image, max_bytes, image_format, grayscale, min_quality, max_quality)
+
+    with open(output_path, "wb") as f:
+        f.write(data)
+
+    if len(data) > max_bytes:
+        print(f"Warning: {output_path} is {len(data)} bytes, above the {max_bytes} bytes budget.")
+
+    return report
+
+
+def _save_collage(collage, output_path, max_bytes=None, **encode_options):
+    """
+    Save a collage, within a byte budget if max_bytes is given.
+    
+    Args:
+        collage (Image): The collage image
+        output_path (str): The path to save the collage
+        max_bytes (int, optional): Byte budget, see save_image_within_budget. Defaults to None (no budget)
+        **encode_options: Extra arguments for save_image_within_budget
+        
+    Returns:
+        dict: Encoding report (see save_image_within_budget), or None if saving failed
+    """
     try:
-        collage.save(output_path)
-        print(f"Collage saved successfully to {output_path}")
+        if max_bytes:
+            report = save_image_within_budget(collage, output_path, max_bytes, **encode_options)
+        else:
+            collage.save(output_path)
+            report = {"bytes": os.path.getsize(output_path), "quality": None, "format": collage.format, "size": collage.size}
+        print(f"Collage saved successfully to {output_path} ({report['size'][0]}x{report['size'][1]}, {report['bytes'] / 1024:.0f} KB)")
+        return report
     except Exception as e:
         print(f"Error saving collage: {e}")
+        return None
 
 
-def convert_image_to_pdf(image_path, output_pdf_path):
+def convert_image_to_pdf(image_path, output_pdf_path, max_dpi=None, max_bytes=None):
     """
     Converts a single image to a PDF file.
     
     Args:
         image_path (str): Path to the source image
         output_pdf_path (str): Path where the PDF should be saved
+        max_dpi (int, optional): Downsample the image to at most this resolution on an A4 page.
+                                 Defaults to None (embed the original image)
+        max_bytes (int, optional): Re-encode the image to at most this many bytes.
+                                   Defaults to None (embed the original image)
+        
+    Returns:
+        dict: Sizes in bytes, with the keys original_bytes and pdf_bytes, or None if the conversion failed
     """
     try:
-        with open(output_pdf_path, "wb") as f:
-            f.write(img2pdf.convert(image_path))
+        report = _write_pdf(image_path, output_pdf_path, max_dpi, max_bytes)
         print(f"PDF saved successfully to {output_pdf_path}")
+        _print_pdf_report(output_pdf_path, report)
+        return report
     except Exception as e:
         print(f"Error creating PDF for {image_path}: {e}")
+        return None
 
 
-def convert_images_to_pdfs(image_paths):
+def convert_images_to_pdfs(image_paths, max_dpi=None, max_bytes=None):
     """
     Converts a list of images to a list of PDF files.
     
     Args:
         image_paths (list): List of paths to image files
+        max_dpi (int, optional): See convert_image_to_pdf. Defaults to None
+        max_bytes (int, optional): See convert_image_to_pdf. Defaults to None
         
     Returns:
         list: List of paths to the created PDF files
@@ -157,6 +938,6 @@ def convert_images_to_pdfs(image_paths):
     pdf_paths = []
     for image_path in image_paths:
         pdf_path = image_path.replace(".jpg", ".pdf").replace(".png", ".pdf")
-        convert_image_to_pdf(image_path, pdf_path)
+        convert_image_to_pdf(image_path, pdf_path, max_dpi, max_bytes)
         pdf_paths.append(pdf_path)
     return pdf_paths
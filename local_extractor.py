@@ -0,0 +1,333 @@
+"""
+Local Extraction Module
+Rule-based extraction and validation of the fields with strict formats (CPF, RG, CEP, dates, CIDs)
+from OCR text, without calling the AI.
+"""
+
+import re
+from datetime import date
+
+
+# CPF written as 000.000.000-00 (punctuation optional)
+CPF_PATTERN = re.compile(r"(?<![\d.])(\d{3})\.?(\d{3})\.?(\d{3})\s?-?\s?(\d{2})(?![\d-])")
+
+# RG number right after an "RG" / "REGISTRO GERAL" label
+RG_PATTERN = re.compile(r"(?:\bRG\b|REGISTRO\s+GERAL)\W{0,15}(\d[\d.]{4,12}(?:-\s?[\dXx])?)(?!\d)", re.IGNORECASE)
+
+# CEPs: "CEP" labelled ones first, then any 00000-000 / 00.000-000 pattern
+LABELLED_CEP_PATTERN = re.compile(r"CEP\W{0,5}(\d{2}\.?\d{3})\s?-?\s?(\d{3})(?!\d)", re.IGNORECASE)
+CEP_PATTERN = re.compile(r"(?<![\d.])(\d{2}\.?\d{3})-(\d{3})(?!\d)")
+
+# Dates as 01/02/2015, 01-02-2015, 01.02.2015 or "1 de fevereiro de 2015"
+NUMERIC_DATE_PATTERN = re.compile(r"(?<!\d)(\d{1,2})\s?[/.-]\s?(\d{1,2})\s?[/.-]\s?(\d{4})(?!\d)")
+WRITTEN_DATE_PATTERN = re.compile(r"(?<!\d)(\d{1,2})\s+de\s+([a-zç]+)\s+de\s+(\d{4})(?!\d)", re.IGNORECASE)
+MONTHS = {
+    "janeiro": 1, "fevereiro": 2, "marco": 3, "março": 3, "abril": 4, "maio": 5, "junho": 6,
+    "julho": 7, "agosto": 8, "setembro": 9, "outubro": 10, "novembro": 11, "dezembro": 12,
+}
+
+# Label of the birth date, searched right before a date
+BIRTH_DATE_LABEL_PATTERN = re.compile(r"NASC", re.IGNORECASE)
+
+# CIDs accepted by the web forms: CID-10 F84.x and CID-11 6A02.x
+CID10_PATTERN = re.compile(r"\bF\s?84(?:\s?\.\s?(\d))?\b", re.IGNORECASE)
+CID11_PATTERN = re.compile(r"\b6A02(?:\s?\.\s?([0-5YZ]))?\b", re.IGNORECASE)
+
+# Section headers of merged per-document texts, e.g. "=== cpf_do_menor ==="
+SECTION_PATTERN = re.compile(r"^=== (\w+) ===$", re.MULTILINE)
+
+# Section of the merged per-document texts where the beneficiary's CEP is written
+RESIDENCE_SECTION = "comprovante_residencia"
+
+# Name written on the line after a "NOME" label
+NAME_PATTERN = re.compile(r"^\s*NOME\b[^\n]*\n\s*([A-ZÀ-Ý][A-ZÀ-Ý ]+[A-ZÀ-Ý])\s*$", re.MULTILINE)
+
+
+def is_valid_cpf(cpf):
+    """
+    Check the format and the check digits of a CPF.
+
+    Args:
+        cpf (str): CPF, with or without punctuation
+
+    Returns:
+        bool: True if the CPF is valid
+    """
+    digits = re.sub(r"\D", "", cpf or "")
+    if len(digits) != 11 or digits == digits[0] * 11:
+        return False
+
+    for length in (9, 10):
+        total = sum(int(digit) * weight for digit, weight in zip(digits[:length], range(length + 1, 1, -1)))
+        check_digit = (total * 10) % 11 % 10
+        if check_digit != int(digits[length]):
+            return False
+    return True
+
+
+def format_cpf(cpf):
+    """
+    Format a CPF as 000.000.000-00.
+
+    Args:
+        cpf (str): CPF, with or without punctuation
+
+    Returns:
+        str: The formatted CPF
+    """
+    digits = re.sub(r"\D", "", cpf)
+    return f"{digits[:3]}.{digits[3:6]}.{digits[6:9]}-{digits[9:]}"
+
+
+def is_valid_cep(cep):
+    """
+    Check the format of a CEP.
+
+    Args:
+        cep (str): CEP, with or without punctuation
+
+    Returns:
+        bool: True if the CEP has 8 digits and is not all zeros
+    """
+    digits = re.sub(r"\D", "", cep or "")
+    return len(digits) == 8 and digits != "00000000"
+
+
+def normalize_date(text, min_year=1900):
+    """
+    Normalize a date to DD/MM/YYYY, rejecting impossible and future dates.
+
+    Args:
+        text (str): Date as 01/02/2015, 01-02-2015, 01.02.2015 or "1 de fevereiro de 2015"
+        min_year (int, optional): Earliest year accepted. Defaults to 1900
+
+    Returns:
+        str: The normalized date, or None if it is not a valid date
+    """
+    match = NUMERIC_DATE_PATTERN.search(text or "")
+    if match:
+        day, month, year = (int(part) for part in match.groups())
+    else:
+        match = WRITTEN_DATE_PATTERN.search(text or "")
+        if not match or match.group(2).lower() not in MONTHS:
+            return None
+        day, month, year = int(match.group(1)), MONTHS[match.group(2).lower()], int(match.group(3))
+
+    try:
+        parsed = date(year, month, day)
+    except ValueError:
+        return None
+    if parsed.year < min_year or parsed > date.today():
+        return None
+    return parsed.strftime("%d/%m/%Y")
+
+
+def find_ceps_in_text(text):
+    """
+    Find the CEPs written in a text, labelled ones first.
+
+    Args:
+        text (str): OCR text
+
+    Returns:
+        list: Unique CEPs with 8 digits only, in order of preference
+    """
+    ceps = []
+    for pattern in (LABELLED_CEP_PATTERN, CEP_PATTERN):
+        for match in pattern.finditer(text or ""):
+            cep = (match.group(1) + match.group(2)).replace(".", "")
+            if cep not in ceps:
+                ceps.append(cep)
+    return ceps
+
+
+def find_cids_in_text(text):
+    """
+    Find the autism CIDs (F84.x and 6A02.x) written in a text.
+
+    Args:
+        text (str): OCR text
+
+    Returns:
+        list: Unique CIDs in the format used by the web forms (e.g. ['10 F84.0', '11 6A02.1'])
+    """
+    cids = []
+    for match in CID10_PATTERN.finditer(text or ""):
+        cid = f"10 F84.{match.group(1)}" if match.group(1) else "10 F84"
+        if cid not in cids:
+            cids.append(cid)
+    for match in CID11_PATTERN.finditer(text or ""):
+        cid = f"11 6A02.{match.group(1).upper()}" if match.group(1) else "11 6A02"
+        if cid not in cids:
+            cids.append(cid)
+    return cids
+
+
+def find_valid_cpfs_in_text(text):
+    """
+    Find the CPFs with valid check digits written in a text.
+
+    Args:
+        text (str): OCR text
+
+    Returns:
+        list: Unique formatted CPFs, in order of appearance
+    """
+    cpfs = []
+    for match in CPF_PATTERN.finditer(text or ""):
+        cpf = "".join(match.groups())
+        if is_valid_cpf(cpf) and format_cpf(cpf) not in cpfs:
+            cpfs.append(format_cpf(cpf))
+    return cpfs
+
+
+def _find_birth_date(text):
+    """
+    Find a date labelled as birth date in a text.
+
+    Args:
+        text (str): OCR text
+
+    Returns:
+        str: The normalized date, or None if there is no single labelled birth date
+    """
+    dates = set()
+    for match in NUMERIC_DATE_PATTERN.finditer(text):
+        if BIRTH_DATE_LABEL_PATTERN.search(text[max(0, match.start() - 40):match.start()]):
+            normalized = normalize_date(match.group(0))
+            if normalized:
+                dates.add(normalized)
+    return dates.pop() if len(dates) == 1 else None
+
+
+def _split_sections(text):
+    """
+    Split a merged per-document text into its sections.
+
+    Args:
+        text (str): Text with "=== name ===" headers
+
+    Returns:
+        dict: Mapping each section name to its text (empty if there are no headers)
+    """
+    matches = list(SECTION_PATTERN.finditer(text))
+    sections = {}
+    for index, match in enumerate(matches):
+        end = matches[index + 1].start() if index + 1 < len(matches) else len(text)
+        sections[match.group(1)] = text[match.end():end]
+    return sections
+
+
+def _section_fields(section_name, section_text):
+    """
+    Extract the fields of one identity document section.
+
+    Args:
+        section_name (str): Document name, e.g. "cpf_do_menor"
+        section_text (str): OCR text of the document
+
+    Returns:
+        dict: Fields found in the section
+    """
+    if section_name.endswith("_do_menor"):
+        role = "menor"
+    elif section_name.endswith("_do_responsavel"):
+        role = "responsavel"
+    else:
+        return {}
+
+    fields = {}
+    cpfs = find_valid_cpfs_in_text(section_text)
+    if len(cpfs) == 1:
+        fields[f"cpf_do_{role}"] = cpfs[0]
+
+    rgs = {match.group(1).replace(" ", "") for match in RG_PATTERN.finditer(section_text)}
+    if len(rgs) == 1:
+        fields[f"rg_do_{role}"] = rgs.pop()
+
+    names = {match.group(1).strip() for match in NAME_PATTERN.finditer(section_text)}
+    if len(names) == 1 and len(next(iter(names)).split()) >= 2:
+        fields[f"nome_do_{role}"] = names.pop()
+
+    if role == "menor":
+        birth_date = _find_birth_date(section_text)
+        if birth_date:
+            fields["data_de_nascimento_do_menor"] = birth_date
+
+    return fields
+
+
+def validate_extracted_data(extracted_dict):
+    """
+    Check the format of the fields extracted by the AI. Empty fields are not checked.
+
+    Args:
+        extracted_dict (dict): Extracted data
+
+    Returns:
+        list: Names of the fields with invalid values
+    """
+    invalid_fields = []
+    for field in ("cpf_do_menor", "cpf_do_responsavel"):
+        if extracted_dict.get(field) and not is_valid_cpf(extracted_dict[field]):
+            invalid_fields.append(field)
+
+    birth_date = extracted_dict.get("data_de_nascimento_do_menor")
+    if birth_date and normalize_date(str(birth_date)) is None:
+        invalid_fields.append("data_de_nascimento_do_menor")
+
+    if extracted_dict.get("cep") and not is_valid_cep(extracted_dict["cep"]):
+        invalid_fields.append("cep")
+
+    cids = extracted_dict.get("cids") or []
+    if isinstance(cids, str):
+        cids = [cids]
+    if any(not find_cids_in_text(str(cid)) for cid in cids):
+        invalid_fields.append("cids")
+
+    return invalid_fields
+
+
+def extract_fields_locally(text):
+    """
+    Extract the fields that can be determined with certainty from OCR text, without the AI.
+
+    CIDs are searched in the whole text. CPF, RG, name and birth date can only be told apart
+    between the child and the responsible person when the text has per-document sections
+    (see data_extractor.get_data_from_documents), and only unambiguous values are kept. The CEP is
+    only taken from the residence proof section: elsewhere it may be another address, e.g. the
+    clinic's in the header of the medical report.
+
+    Args:
+        text (str): OCR text
+
+    Returns:
+        dict: The fields found, with the same keys and formats as data_extractor.get_data_from_text
+    """
+    fields = {}
+    sections = _split_sections(text or "")
+
+    residence_text = sections.get(RESIDENCE_SECTION, "")
+    labelled_ceps = {"".join(match.groups()).replace(".", "") for match in LABELLED_CEP_PATTERN.finditer(residence_text)}
+    ceps = labelled_ceps or set(find_ceps_in_text(residence_text))
+    ceps = {cep for cep in ceps if is_valid_cep(cep)}
+    if len(ceps) == 1:
+        cep = ceps.pop()
+        fields["cep"] = f"{cep[:5]}-{cep[5:]}"
+
+    # Bare codes (e.g. a "F84" mentioned in passing) say nothing about the diagnosis
+    cids = [cid for cid in find_cids_in_text(text) if "." in cid]
+    if cids:
+        fields["cids"] = cids
+
+    # A field found in two documents (e.g. the CPF on both CPF and RG photos) must agree
+    conflicting = set()
+    for section_name, section_text in sections.items():
+        for field, value in _section_fields(section_name, section_text).items():
+            if field in fields and fields[field] != value:
+                conflicting.add(field)
+            fields[field] = value
+    for field in conflicting:
+        del fields[field]
+
+    return fields
@@ -5,8 +5,8 @@ Automated form filling system that processes images, extracts data, and fills we
 
 import json
 import pprint
-from image_processor import organize_image_files, create_image_collage
-from data_extractor import get_image_text, get_data_from_text
+from image_processor import organize_image_files, create_packed_collage, UPLOAD_MAX_BYTES
+from data_extractor import get_data_from_images
 from web_automation import (
     open_new_driver,
     fill_cipteape_form,
@@ -46,15 +46,11 @@ def process_images_and_extract_data(image_files_dict, person_name):
     
     if len(collage_images) >= 4:
         collage_path = organized_files.get("cpf_do_menor", "").replace("cpf_do_menor", "documents_collage")
-        create_image_collage(collage_images, collage_path, rows=2, cols=2, image_size=(1000, 1000))
+        create_packed_collage(collage_images, collage_path, target_long_edge=2000, max_bytes=UPLOAD_MAX_BYTES)
         
-        # Extract text from collage
-        print("\nExtracting text from collage...")
-        full_text = get_image_text(collage_path)
-        
-        # Parse data from text
-        print("\nParsing data from extracted text...")
-        data = get_data_from_text(full_text)
+        # Extract structured data from collage
+        print("\nExtracting data from collage...")
+        data = get_data_from_images([collage_path])
         
         return organized_files, data
     else:
@@ -0,0 +1,236 @@
+"""
+Rate Limiter Module
+Client-side limits for the AI requests made with one API key:
+    - TokenBucket: requests per second, optionally shared by every process on the machine through a lock file
+    - AIMDController: requests in flight, halved when the API answers 429 and slowly raised while requests succeed
+"""
+
+import os
+import time
+import struct
+import asyncio
+import threading
+from pathlib import Path
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+# State of a shared bucket: available tokens and the time they were counted
+BUCKET_STATE = struct.Struct("<dd")
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at a fixed rate. Each request takes one token, waiting when there is none.
+
+    With a state_path, the tokens are kept in that file and every process using the same file
+    shares them, so several operators or a batch import on one machine stay under one quota.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, rate, capacity=None, state_path=None):
+        """
+        Initialize the bucket, full.
+
+        Args:
+            rate (float): Tokens added per second
+            capacity (float, optional): Maximum tokens, i.e. the largest burst. Defaults to one second of tokens, at least 1
+            state_path (str, optional): File shared between processes. Defaults to None (this process only)
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._updated = time.time()
+
+        self._file = None
+        if state_path is not None:
+            state_path = Path(state_path)
+            state_path.parent.mkdir(parents=True, exist_ok=True)
+            state_path.touch(exist_ok=True)
+            self._file = open(state_path, "r+b")
+
+    def _lock_file(self):
+        """Lock the state file against the other processes (blocking)."""
+        self._file.seek(0)
+        if os.name == "nt":
+            # LK_LOCK gives up after 10 seconds, which only happens if another process hangs holding it
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file(self):
+        """Release the lock of the state file."""
+        self._file.seek(0)
+        if os.name == "nt":
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def _take(self, tokens):
+        """
+        Take tokens if available.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise the seconds until they will be available
+        """
+        with self._lock:
+            if self._file is not None:
+                self._lock_file()
+            try:
+                if self._file is not None:
+                    self._file.seek(0)
+                    data = self._file.read(BUCKET_STATE.size)
+                    if len(data) == BUCKET_STATE.size:
+                        self._tokens, self._updated = BUCKET_STATE.unpack(data)
+
+                now = time.time()
+                # Wall-clock time, shared by the processes; a clock going back just refills nothing
+                available = min(self.capacity, self._tokens + max(0.0, now - self._updated) * self.rate)
+                wait = 0.0 if available >= tokens else (tokens - available) / self.rate
+                self._tokens = available - tokens if wait == 0.0 else available
+                self._updated = now
+
+                if self._file is not None:
+                    self._file.seek(0)
+                    self._file.write(BUCKET_STATE.pack(self._tokens, self._updated))
+                    self._file.flush()
+                return wait
+            finally:
+                if self._file is not None:
+                    self._unlock_file()
+
+    def acquire(self, tokens=1, timeout=None):
+        """
+        Wait until the tokens are available and take them.
+
+        Args:
+            tokens (float, optional): Tokens to take. Defaults to 1
+            timeout (float, optional): Maximum seconds to wait. Defaults to None (no limit)
+
+        Returns:
+            bool: True if the tokens were taken, False if they would not be available in time
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._take(tokens)
+            if wait == 0.0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=1, timeout=None):
+        """Async version of acquire."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._take(tokens)
+            if wait == 0.0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+    def close(self):
+        """Close the state file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class AIMDController:
+    """
+    Limits the requests in flight with additive increase / multiplicative decrease:
+    the limit grows by one after a full limit's worth of successful requests, and is
+    multiplied by decrease_factor when a request is throttled (at most once per cooldown,
+    so one burst of 429s counts as one signal).
+    Safe to use from several threads.
+    """
+
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=16, decrease_factor=0.5, cooldown=1.0):
+        """
+        Initialize the controller.
+
+        Args:
+            initial_limit (int, optional): Requests in flight allowed at the start. Defaults to 4
+            min_limit (int, optional): Lowest limit. Defaults to 1
+            max_limit (int, optional): Highest limit. Defaults to 16
+            decrease_factor (float, optional): Multiplier of the limit when throttled. Defaults to 0.5
+            cooldown (float, optional): Seconds after a decrease during which throttling is ignored. Defaults to 1.0
+        """
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._last_decrease = 0.0
+
+    @property
+    def in_flight(self):
+        """Requests currently in flight."""
+        return self._in_flight
+
+    def try_acquire(self):
+        """
+        Take a slot if one is free.
+
+        Returns:
+            bool: True if the slot was taken
+        """
+        with self._condition:
+            if self._in_flight < int(self.limit):
+                self._in_flight += 1
+                return True
+            return False
+
+    def acquire(self, timeout=None):
+        """
+        Wait for a free slot and take it.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to None (no limit)
+
+        Returns:
+            bool: True if the slot was taken, False on timeout
+        """
+        with self._condition:
+            taken = self._condition.wait_for(lambda: self._in_flight < int(self.limit), timeout)
+            if taken:
+                self._in_flight += 1
+            return taken
+
+    async def acquire_async(self, timeout=None, poll_interval=0.05):
+        """Async version of acquire. Polls, so a cancelled wait never holds a slot."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.try_acquire():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(poll_interval)
+        return True
+
+    def release(self, throttled=False, succeeded=True):
+        """
+        Give back a slot and adjust the limit with the result of the request.
+        Requests that failed for other reasons leave the limit as it is.
+
+        Args:
+            throttled (bool, optional): Whether the API refused the request for quota. Defaults to False
+            succeeded (bool, optional): Whether the request succeeded. Defaults to True
+        """
+        with self._condition:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+                    print(f"Requests throttled, allowing {int(self.limit)} at the same time.")
+            elif succeeded:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
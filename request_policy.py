@@ -0,0 +1,351 @@
+"""
+Request Policy Module
+Deadlines, retries with exponential backoff and jitter, and optional hedging for the AI requests.
+
+A request is a function that receives the seconds it has left and returns the response, e.g.:
+    policy.call(lambda timeout: model.generate_content(prompt, request_options={"timeout": timeout}))
+
+Hedging sends a second copy of a request that is taking longer than the usual (95th percentile)
+response time of its kind, and keeps whichever answers first.
+
+Every copy of a request also waits for the policy's rate limiter and concurrency controller, if any
+(see rate_limiter.py).
+"""
+
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:
+    google_exceptions = None
+
+
+# Errors worth trying again: quota, server errors and timeouts
+RETRYABLE_ERRORS = (TimeoutError, ConnectionError, asyncio.TimeoutError)
+if google_exceptions is not None:
+    RETRYABLE_ERRORS += (
+        google_exceptions.TooManyRequests,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.ServerError,
+        google_exceptions.DeadlineExceeded,
+    )
+
+# HTTP status codes worth trying again, for errors that only carry a code
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Errors meaning the quota of the API key was exceeded
+THROTTLED_ERRORS = ()
+if google_exceptions is not None:
+    THROTTLED_ERRORS = (google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted)
+
+# Number of response times kept per kind of request, and how many are needed before hedging
+LATENCY_HISTORY_SIZE = 100
+MIN_LATENCY_SAMPLES_TO_HEDGE = 10
+
+# Threads running the requests. A request that missed its deadline keeps its thread until the
+# library gives up on it, so there is room for a few of those.
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="request")
+
+
+def is_retryable(error):
+    """
+    Check if a failed request is worth trying again.
+
+    Args:
+        error (Exception): The error raised by the request
+
+    Returns:
+        bool: True for timeouts, connection errors, quota errors and server errors
+    """
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    return isinstance(code, int) and code in RETRYABLE_STATUS_CODES
+
+
+def is_throttled(error):
+    """
+    Check if a request failed because the quota was exceeded.
+
+    Args:
+        error (Exception): The error raised by the request
+
+    Returns:
+        bool: True for 429 / resource exhausted errors
+    """
+    if isinstance(error, THROTTLED_ERRORS):
+        return True
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    return code == 429
+
+
+class RequestPolicy:
+    """
+    Runs requests with a deadline per attempt, a total deadline, retries on retryable errors and
+    optional hedging. Safe to use from several threads.
+    """
+
+    def __init__(self, timeout=60, total_timeout=180, max_attempts=3, base_delay=1.0, max_delay=20.0,
+                 hedge=False, rate_limiter=None, concurrency=None):
+        """
+        Initialize the policy.
+
+        Args:
+            timeout (float, optional): Seconds each attempt may take. Defaults to 60
+            total_timeout (float, optional): Seconds all the attempts together may take. Defaults to 180
+            max_attempts (int, optional): Maximum number of attempts. Defaults to 3
+            base_delay (float, optional): Upper bound of the wait before the first retry, doubled at each retry. Defaults to 1.0
+            max_delay (float, optional): Maximum wait between attempts. Defaults to 20.0
+            hedge (bool, optional): Send a second copy of slow requests. Defaults to False
+            rate_limiter (rate_limiter.TokenBucket, optional): Limits the requests per second. Defaults to None
+            concurrency (rate_limiter.AIMDController, optional): Limits the requests in flight. Defaults to None
+        """
+        self.timeout = timeout
+        self.total_timeout = total_timeout
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.rate_limiter = rate_limiter
+        self.concurrency = concurrency
+
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self.stats = {
+            "requests": 0, "attempts": 0, "retries": 0, "timeouts": 0, "throttled": 0, "hedges": 0, "hedge_wins": 0,
+        }
+
+    def backoff_delay(self, attempt):
+        """
+        Wait before the next attempt: exponential backoff with full jitter.
+
+        Args:
+            attempt (int): Number of the attempt that just failed, starting at 0
+
+        Returns:
+            float: Seconds to wait
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def hedge_delay(self, kind):
+        """
+        Time after which a request of this kind is considered slow.
+
+        Args:
+            kind (str): Kind of request
+
+        Returns:
+            float: The 95th percentile of the recent response times, or None if there are too few of them
+        """
+        with self._lock:
+            latencies = sorted(self._latencies.get(kind, ()))
+        if len(latencies) < MIN_LATENCY_SAMPLES_TO_HEDGE:
+            return None
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def _record(self, stat):
+        """Increment a stat."""
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _record_latency(self, kind, seconds):
+        """Keep the response time of a successful request."""
+        with self._lock:
+            self._latencies.setdefault(kind, deque(maxlen=LATENCY_HISTORY_SIZE)).append(seconds)
+
+    def _finish(self, kind, start, error=None):
+        """Record the end of one copy of a request and give back its concurrency slot."""
+        throttled = error is not None and is_throttled(error)
+        if throttled:
+            self._record("throttled")
+        if self.concurrency is not None:
+            self.concurrency.release(throttled, succeeded=error is None)
+        if error is None:
+            self._record_latency(kind, time.monotonic() - start)
+
+    def _timed(self, function, timeout, kind):
+        """Run one copy of a request after the limiters let it through, recording its response time."""
+        deadline = time.monotonic() + timeout
+        if self.rate_limiter is not None and not self.rate_limiter.acquire(timeout=timeout):
+            raise TimeoutError("Rate limit would delay the request past its deadline")
+        if self.concurrency is not None and not self.concurrency.acquire(timeout=deadline - time.monotonic()):
+            raise TimeoutError("No free request slot before the deadline")
+
+        self._record("attempts")
+        start = time.monotonic()
+        try:
+            result = function(deadline - start)
+        except Exception as e:
+            self._finish(kind, start, e)
+            raise
+        self._finish(kind, start)
+        return result
+
+    def _attempt(self, function, timeout, kind, hedge):
+        """
+        Run one attempt of a request, hedged if it is slow.
+
+        Raises:
+            TimeoutError: If no copy answered within the timeout
+        """
+        deadline = time.monotonic() + timeout
+        first = _executor.submit(self._timed, function, timeout, kind)
+        futures = [first]
+
+        hedge_delay = self.hedge_delay(kind) if hedge else None
+        if hedge_delay is not None and hedge_delay < timeout:
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done:
+                self._record("hedges")
+                futures.append(_executor.submit(self._timed, function, deadline - time.monotonic(), kind))
+
+        error = None
+        while futures:
+            done, _ = wait(futures, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                self._record("timeouts")
+                raise TimeoutError(f"No response in {timeout:.1f}s")
+            for future in done:
+                if future.exception() is None:
+                    if future is not first:
+                        self._record("hedge_wins")
+                    return future.result()
+                error = future.exception()
+            futures = [future for future in futures if future not in done]
+        raise error
+
+    def call(self, function, kind="default", hedge=None):
+        """
+        Run a request with the policy.
+
+        Args:
+            function (callable): Receives the seconds the attempt has left and returns the response
+            kind (str, optional): Kind of request, response times are tracked per kind. Defaults to "default"
+            hedge (bool, optional): Override the policy's hedging for this request. Defaults to None
+
+        Returns:
+            The response of the first successful attempt
+
+        Raises:
+            Exception: The error of the last attempt, if it was not retryable or no attempts were left
+        """
+        hedge = self.hedge if hedge is None else hedge
+        self._record("requests")
+        start = time.monotonic()
+        for attempt in range(self.max_attempts):
+            remaining = self.total_timeout - (time.monotonic() - start)
+            try:
+                return self._attempt(function, min(self.timeout, remaining), kind, hedge)
+            except Exception as e:
+                delay = self.backoff_delay(attempt)
+                time_left = self.total_timeout - (time.monotonic() - start)
+                if not is_retryable(e) or attempt + 1 == self.max_attempts or delay >= time_left:
+                    raise
+                print(f"Request failed ({e}), trying again in {delay:.1f}s...")
+                self._record("retries")
+                time.sleep(delay)
+
+    async def _timed_async(self, function, timeout, kind):
+        """Async version of _timed."""
+        deadline = time.monotonic() + timeout
+        if self.rate_limiter is not None and not await self.rate_limiter.acquire_async(timeout=timeout):
+            raise TimeoutError("Rate limit would delay the request past its deadline")
+        if self.concurrency is not None and not await self.concurrency.acquire_async(timeout=deadline - time.monotonic()):
+            raise TimeoutError("No free request slot before the deadline")
+
+        self._record("attempts")
+        start = time.monotonic()
+        try:
+            result = await function(deadline - start)
+        except asyncio.CancelledError:
+            # The copy that lost a hedge, or one past its deadline
+            if self.concurrency is not None:
+                self.concurrency.release(succeeded=False)
+            raise
+        except Exception as e:
+            self._finish(kind, start, e)
+            raise
+        self._finish(kind, start)
+        return result
+
+    async def _attempt_async(self, function, timeout, kind, hedge):
+        """Async version of _attempt. The copy that loses a hedge is cancelled."""
+        deadline = time.monotonic() + timeout
+        first = asyncio.ensure_future(self._timed_async(function, timeout, kind))
+        tasks = [first]
+        try:
+            hedge_delay = self.hedge_delay(kind) if hedge else None
+            if hedge_delay is not None and hedge_delay < timeout:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done:
+                    self._record("hedges")
+                    tasks.append(asyncio.ensure_future(self._timed_async(function, deadline - time.monotonic(), kind)))
+
+            error = None
+            while tasks:
+                done, _ = await asyncio.wait(
+                    tasks, timeout=max(0, deadline - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    self._record("timeouts")
+                    raise TimeoutError(f"No response in {timeout:.1f}s")
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self._record("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+                tasks = [task for task in tasks if task not in done]
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def call_async(self, function, kind="default", hedge=None):
+        """
+        Async version of call.
+
+        Args:
+            function (callable): Receives the seconds the attempt has left and returns a coroutine with the response
+            kind (str, optional): Kind of request, response times are tracked per kind. Defaults to "default"
+            hedge (bool, optional): Override the policy's hedging for this request. Defaults to None
+
+        Returns:
+            The response of the first successful attempt
+        """
+        hedge = self.hedge if hedge is None else hedge
+        self._record("requests")
+        start = time.monotonic()
+        for attempt in range(self.max_attempts):
+            remaining = self.total_timeout - (time.monotonic() - start)
+            try:
+                return await self._attempt_async(function, min(self.timeout, remaining), kind, hedge)
+            except Exception as e:
+                delay = self.backoff_delay(attempt)
+                time_left = self.total_timeout - (time.monotonic() - start)
+                if not is_retryable(e) or attempt + 1 == self.max_attempts or delay >= time_left:
+                    raise
+                print(f"Request failed ({e}), trying again in {delay:.1f}s...")
+                self._record("retries")
+                await asyncio.sleep(delay)
+
+    def get_stats(self):
+        """
+        Get the counters of the policy since the program started.
+
+        Returns:
+            dict: requests, attempts, retries, timeouts, throttled, hedges, hedge_wins, the hedge delay
+                  per kind of request and the current concurrency limit
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            kinds = list(self._latencies)
+        stats["hedge_delays"] = {kind: self.hedge_delay(kind) for kind in kinds}
+        if self.concurrency is not None:
+            stats["concurrency_limit"] = int(self.concurrency.limit)
+        return stats
@@ -5,6 +5,9 @@ Modern drag-and-drop interface for document image collection and form automation
 
 import sys
 import os
+import hashlib
+import threading
+import multiprocessing
 from pathlib import Path
 import json
 from dotenv import load_dotenv
@@ -13,8 +16,8 @@ from PyQt5.QtWidgets import (
     QLabel, QPushButton, QScrollArea, QFrame, QFileDialog, QMessageBox, QLineEdit,
     QStackedWidget, QProgressBar, QCheckBox, QGridLayout, QMenu, QDateEdit, QInputDialog
 )
-from PyQt5.QtCore import Qt, QMimeData, pyqtSignal, QTimer, QDate
-from PyQt5.QtGui import QPixmap, QDragEnterEvent, QDropEvent, QPalette, QColor, QFont, QDrag
+from PyQt5.QtCore import Qt, QMimeData, pyqtSignal, QTimer, QDate, QObject, QRunnable, QThreadPool, QSize
+from PyQt5.QtGui import QPixmap, QDragEnterEvent, QDropEvent, QPalette, QColor, QFont, QDrag, QImage, QImageReader
 from PIL import Image
 
 # Import our processing modules
@@ -30,6 +33,164 @@ if env_path.exists():
 # Google AI API Key from environment or default
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "")
 
+# Size of the document previews in the drop zones
+THUMBNAIL_SIZE = 250
+
+# Previews already decoded, keyed by the hash of the image file
+THUMBNAIL_CACHE_DIR = Path.home() / ".auto_preenchedor_data" / ".thumbnails"
+
+# Maximum total size of the previews kept, the least recently shown are deleted first
+THUMBNAIL_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+# Several loaders run at once, one eviction at a time is enough
+_thumbnail_cache_lock = threading.Lock()
+
+# Peak memory allowed when building the OCR collage (keeps older 4 GB machines from swapping)
+COLLAGE_MAX_MEMORY_MB = 256
+
+# Read each document in its own concurrent request instead of sending a single collage
+USE_PER_DOCUMENT_OCR = False
+
+# Read the documents with Tesseract first (if installed) and only send them to the AI when required fields are missing
+USE_LOCAL_OCR_FIRST = False
+
+
+def _evict_thumbnails(max_bytes=THUMBNAIL_CACHE_MAX_BYTES):
+    """
+    Delete the least recently used previews until THUMBNAIL_CACHE_DIR fits in max_bytes.
+    
+    Args:
+        max_bytes (int, optional): Maximum total size of the previews. Defaults to THUMBNAIL_CACHE_MAX_BYTES
+    """
+    with _thumbnail_cache_lock:
+        entries = []
+        for entry_path in THUMBNAIL_CACHE_DIR.glob("*.png"):
+            try:
+                stat = entry_path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+        
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_bytes <= max_bytes:
+                break
+            entry_path.unlink(missing_ok=True)
+            total_bytes -= size
+
+
+class ThumbnailSignals(QObject):
+    """
+    Signals emitted by ThumbnailLoader (QRunnable cannot emit signals itself).
+    """
+    
+    loaded = pyqtSignal(str, QImage)  # Signal: (file_path, thumbnail)
+    failed = pyqtSignal(str, str)  # Signal: (file_path, error message)
+
+
+class ThumbnailLoader(QRunnable):
+    """
+    Loads the preview of an image outside the GUI thread.
+    
+    The image is decoded directly at preview size with QImageReader and the result is stored in
+    THUMBNAIL_CACHE_DIR, keyed by the file content hash, so the same document is never decoded twice.
+    The cache is kept under THUMBNAIL_CACHE_MAX_BYTES by deleting the least recently used previews.
+    """
+    
+    def __init__(self, file_path):
+        """
+        Initialize a thumbnail loader.
+        
+        Args:
+            file_path (str): Path to the image file
+        """
+        super().__init__()
+        self.file_path = file_path
+        self.signals = ThumbnailSignals()
+    
+    def run(self):
+        """Load the thumbnail from the cache, or decode and cache it."""
+        try:
+            hasher = hashlib.sha256()
+            with open(self.file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    hasher.update(chunk)
+            cache_path = THUMBNAIL_CACHE_DIR / f"{hasher.hexdigest()}_{THUMBNAIL_SIZE}.png"
+            
+            if cache_path.exists():
+                thumbnail = QImage(str(cache_path))
+                if not thumbnail.isNull():
+                    try:
+                        os.utime(cache_path)  # Mark as recently used
+                    except OSError:
+                        pass
+                    self.signals.loaded.emit(self.file_path, thumbnail)
+                    return
+            
+            reader = QImageReader(self.file_path)
+            reader.setAutoTransform(True)
+            original_size = reader.size()
+            if original_size.isValid():
+                # Let the decoder scale down (JPEG decodes straight at a reduced size)
+                reader.setScaledSize(original_size.scaled(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE), Qt.KeepAspectRatio))
+            thumbnail = reader.read()
+            if thumbnail.isNull():
+                raise ValueError(reader.errorString())
+            
+            THUMBNAIL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            if thumbnail.save(str(cache_path), "PNG"):
+                _evict_thumbnails()
+            
+            self.signals.loaded.emit(self.file_path, thumbnail)
+        except Exception as e:
+            self.signals.failed.emit(self.file_path, str(e))
+
+
+class ExtractionStreamSignals(QObject):
+    """
+    Signals emitted by ExtractionStreamer (QRunnable cannot emit signals itself).
+    """
+    
+    field = pyqtSignal(str, object)  # Signal: (field key, value)
+    escalated = pyqtSignal(object)  # Signal: (problems of the fast model's result)
+    finished = pyqtSignal()
+    failed = pyqtSignal(str)  # Signal: (error message)
+
+
+class ExtractionStreamer(QRunnable):
+    """
+    Streams the data fields of the documents outside the GUI thread.
+    
+    Each field is delivered through a signal as soon as the AI writes it, so the window stays
+    responsive while the operator checks the fields that already arrived.
+    """
+    
+    def __init__(self, image_paths, api_key):
+        """
+        Initialize an extraction streamer.
+        
+        Args:
+            image_paths (list): Paths of the images to read
+            api_key (str): Google Generative AI API key
+        """
+        super().__init__()
+        self.image_paths = image_paths
+        self.api_key = api_key
+        self.signals = ExtractionStreamSignals()
+    
+    def run(self):
+        """Stream the fields, falling back to the more precise model when the fast one fails validation."""
+        try:
+            for key, value in data_extractor.stream_data_tiered(
+                self.image_paths,
+                self.api_key,
+                on_escalate=self.signals.escalated.emit
+            ):
+                self.signals.field.emit(key, value)
+            self.signals.finished.emit()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+
 
 class ImageDropZone(QFrame):
     """
@@ -202,40 +363,49 @@ class ImageDropZone(QFrame):
         super().mouseMoveEvent(event)
     
     def _set_image(self, file_path):
-        """Set and display the image."""
+        """Set the image and start loading its preview in the background."""
         self.image_path = file_path
         
-        try:
-            # Load and display image
-            pixmap = QPixmap(file_path)
-            
-            # Scale to fit while maintaining aspect ratio
-            scaled_pixmap = pixmap.scaled(
-                250, 250,
-                Qt.KeepAspectRatio,
-                Qt.SmoothTransformation
-            )
-            
-            # Update drop area to show image
-            self.drop_area.setPixmap(scaled_pixmap)
-            self.drop_area.setText("")
-            self.drop_area.setStyleSheet("""
-                QLabel {
-                    background-color: #e8e8e8;
-                    border: 2px solid #3498db;
-                    border-radius: 5px;
-                }
-            """)
-            
-            # Show clear button
-            self.clear_btn.show()
-            
-            # Emit signal
-            self.image_changed.emit(self.image_key, file_path)
-                
-        except Exception as e:
-            QMessageBox.critical(self, "Erro", f"Erro ao carregar imagem: {e}")
-            self.image_path = None
+        # Show a placeholder until the preview is ready
+        self.drop_area.clear()
+        self.drop_area.setText("Carregando...")
+        
+        # Show clear button
+        self.clear_btn.show()
+        
+        # Keep a reference so the signals object lives until the result is delivered
+        self._thumbnail_loader = ThumbnailLoader(file_path)
+        self._thumbnail_loader.signals.loaded.connect(self._on_thumbnail_loaded)
+        self._thumbnail_loader.signals.failed.connect(self._on_thumbnail_failed)
+        QThreadPool.globalInstance().start(self._thumbnail_loader)
+        
+        # Emit signal
+        self.image_changed.emit(self.image_key, file_path)
+    
+    def _on_thumbnail_loaded(self, file_path, thumbnail):
+        """Display a preview once it has been loaded."""
+        # Ignore previews of images that were replaced or cleared meanwhile
+        if file_path != self.image_path:
+            return
+        
+        # Update drop area to show image
+        self.drop_area.setPixmap(QPixmap.fromImage(thumbnail))
+        self.drop_area.setText("")
+        self.drop_area.setStyleSheet("""
+            QLabel {
+                background-color: #e8e8e8;
+                border: 2px solid #3498db;
+                border-radius: 5px;
+            }
+        """)
+    
+    def _on_thumbnail_failed(self, file_path, error):
+        """Handle an image whose preview could not be loaded."""
+        if file_path != self.image_path:
+            return
+        
+        QMessageBox.critical(self, "Erro", f"Erro ao carregar imagem: {error}")
+        self._clear_image()
     
     def _clear_image(self):
         """Clear the current image."""
@@ -288,6 +458,9 @@ class AutoPreenchedorUI(QMainWindow):
         # Organized file paths
         self.organized_files = {}
         
+        # Extraction streaming in the background, if any (navigation is locked meanwhile)
+        self._extraction_streamer = None
+        
         # Setup UI
         self._setup_ui()
     
@@ -726,6 +899,7 @@ class AutoPreenchedorUI(QMainWindow):
         """)
         back_btn.clicked.connect(self._go_back_to_documents)
         footer_layout.addWidget(back_btn)
+        self.back_btn_page2 = back_btn
         
         # Nova Entrada button
         new_entry_btn = QPushButton("🔄 Nova Entrada")
@@ -749,6 +923,7 @@ class AutoPreenchedorUI(QMainWindow):
         """)
         new_entry_btn.clicked.connect(self._start_new_entry)
         footer_layout.addWidget(new_entry_btn)
+        self.new_entry_btn_page2 = new_entry_btn
         
         footer_layout.addStretch()
         
@@ -1251,8 +1426,8 @@ class AutoPreenchedorUI(QMainWindow):
                             self.ciptea_segunda_checkbox.isChecked() or 
                             self.intermunicipal_checkbox.isChecked())
         
-        # Enable button only if both conditions are met
-        self.next_btn_page2.setEnabled(is_scrolled and has_form_selected)
+        # Enable button only if both conditions are met, and never while the data is still arriving
+        self.next_btn_page2.setEnabled(is_scrolled and has_form_selected and self._extraction_streamer is None)
     
     def _format_phone_number(self, line_edit):
         """Format phone number as user types: (81) 9 9999-9999"""
@@ -1863,126 +2038,300 @@ class AutoPreenchedorUI(QMainWindow):
             # Step 2: Organize image files into folder
             self.organized_files = image_processor.organize_image_files(
                 image_paths_to_organize, 
-                beneficiary_name
+                beneficiary_name,
+                parallel=True,
+                pdf_max_dpi=image_processor.PDF_MAX_DPI,
+                pdf_max_bytes=image_processor.PDF_MAX_BYTES
             )
             
-            # Step 3: Create collage from all images for OCR
-            self.progress_label.setText("Criando colagem de imagens...")
-            QApplication.processEvents()
-            
             # Get all image paths (not PDFs), excluding foto_3x4 and vem since they don't have relevant data
             image_paths_for_collage = [
                 path for key, path in self.organized_files.items() 
                 if not key.endswith('_pdf') and key not in ['foto_3x4', 'vem']
             ]
             
-            # Create collage in the same folder
-            folder_path = Path(self.organized_files[list(self.organized_files.keys())[0]]).parent
-            collage_path = folder_path / "collage.jpg"
+            # A lone CPF or RG was used for both keys above, include each document only once
+            image_paths_for_collage = image_processor.deduplicate_image_paths(image_paths_for_collage)
             
-            # Calculate grid size (3 columns, enough rows)
-            num_images = len(image_paths_for_collage)
-            cols = 3
-            rows = (num_images + cols - 1) // cols  # Ceiling division
-            
-            image_processor.create_image_collage(
-                image_paths_for_collage,
-                str(collage_path),
-                rows,
-                cols,
-                image_size=(1500, 1500)
-            )
-            
-            # Step 4: Extract text from collage using AI
-            self.progress_label.setText("Extraindo texto das imagens com IA...")
-            QApplication.processEvents()
-            
-            extracted_text = data_extractor.get_image_text(
-                str(collage_path),
-                GOOGLE_API_KEY
-            )
+            if USE_PER_DOCUMENT_OCR:
+                # Steps 3-4: Read each document concurrently and parse the merged text
+                self.progress_label.setText("Extraindo dados das imagens com IA...")
+                QApplication.processEvents()
+                
+                documents = {
+                    key: path for key, path in self.organized_files.items()
+                    if path in image_paths_for_collage
+                }
+                
+                self.extracted_data = data_extractor.get_data_from_documents(
+                    documents,
+                    GOOGLE_API_KEY
+                )
+            elif USE_LOCAL_OCR_FIRST:
+                # Steps 3-4: Read each document with Tesseract and parse the text locally, sending the
+                # documents to the AI only if required fields are missing
+                self.progress_label.setText("Extraindo dados das imagens...")
+                QApplication.processEvents()
+                
+                documents = {
+                    key: path for key, path in self.organized_files.items()
+                    if path in image_paths_for_collage
+                }
+                
+                self.extracted_data = data_extractor.get_data_local_ocr_first(
+                    documents,
+                    GOOGLE_API_KEY
+                )
+            else:
+                # Step 3: Create collage from all images for OCR
+                self.progress_label.setText("Criando colagem de imagens...")
+                QApplication.processEvents()
+                
+                # Create collage in the same folder
+                folder_path = Path(self.organized_files[list(self.organized_files.keys())[0]]).parent
+                collage_path = folder_path / "collage.jpg"
+                
+                # Pack the documents keeping their aspect ratio, no stretching and no empty cells
+                image_processor.create_packed_collage(
+                    image_paths_for_collage,
+                    str(collage_path),
+                    target_long_edge=3000,
+                    max_bytes=image_processor.UPLOAD_MAX_BYTES,
+                    max_memory_mb=COLLAGE_MAX_MEMORY_MB
+                )
+                
+                # Step 4: Extract structured data from the collage using AI (single call,
+                # falls back to text extraction + parsing if it fails)
+                self.progress_label.setText("Extraindo dados das imagens com IA...")
+                QApplication.processEvents()
+                
+                # Fill each field as soon as the AI writes it, so it can be checked while the rest arrives.
+                # The stream runs in the background and step 5 runs when it ends (_on_stream_finished)
+                self._start_extraction_stream([str(collage_path)])
+                return
             
-            # Step 5: Parse text into structured data
-            self.progress_label.setText("Processando dados extraídos...")
-            QApplication.processEvents()
+            self._finish_extraction(streamed=False)
+                
+        except Exception as e:
+            self._on_extraction_failed(str(e))
+    
+    def _start_extraction_stream(self, image_paths):
+        """Stream the data of the documents in the background, locking the navigation until it ends.
+        
+        The fast model answers first; if its result fails validation its values are discarded and the
+        pro model's fill the page. Fields the operator edits meanwhile are kept.
+        
+        Args:
+            image_paths (list): Paths of the images to read
+        """
+        self.extracted_data = {}
+        self._start_streamed_fill()
+        
+        # Keep a reference so the signals object lives until the stream ends
+        self._extraction_streamer = ExtractionStreamer(image_paths, GOOGLE_API_KEY)
+        self._extraction_streamer.signals.field.connect(self._on_streamed_field)
+        self._extraction_streamer.signals.escalated.connect(self._on_stream_escalated)
+        self._extraction_streamer.signals.finished.connect(self._on_stream_finished)
+        self._extraction_streamer.signals.failed.connect(self._on_stream_failed)
+        self._set_navigation_enabled(False)
+        QThreadPool.globalInstance().start(self._extraction_streamer)
+    
+    def _set_navigation_enabled(self, enabled):
+        """Enable or disable the buttons leaving the data editing page."""
+        self.back_btn_page2.setEnabled(enabled)
+        self.new_entry_btn_page2.setEnabled(enabled)
+        if enabled:
+            self._check_form_selection()
+        else:
+            self.next_btn_page2.setEnabled(False)
+    
+    def _on_streamed_field(self, key, value):
+        """Show a field as soon as the AI writes it."""
+        self.extracted_data[key] = value
+        self._set_streamed_field_value(key, value)
+    
+    def _on_stream_escalated(self, problems):
+        """Discard the fast model's values when its result failed validation."""
+        self.extracted_data.clear()
+        self._discard_streamed_values()
+        self.progress_label.setText("Conferindo os dados com o modelo mais preciso...")
+    
+    def _on_stream_finished(self):
+        """Finish the extraction once the stream ended."""
+        self._extraction_streamer = None
+        self._set_navigation_enabled(True)
+        try:
+            self._finish_extraction(streamed=True)
+        except Exception as e:
+            self._on_extraction_failed(str(e))
+    
+    def _on_stream_failed(self, error):
+        """Handle a stream that failed."""
+        self._extraction_streamer = None
+        self._set_navigation_enabled(True)
+        self._on_extraction_failed(error)
+    
+    def _finish_extraction(self, streamed):
+        """Populate the fields with the extracted data and report the result.
+        
+        Args:
+            streamed (bool): Whether the fields were already filled on screen while the AI answered
+        
+        Raises:
+            Exception: If no data was extracted
+        """
+        # Step 5: Populate fields with extracted data
+        if self.extracted_data:
+            # Add missing fields with empty values
+            all_fields = [
+                "nome_do_responsavel", "nome_do_menor", "nome_da_mae_do_menor",
+                "cpf_do_responsavel", "rg_do_responsavel", "cpf_do_menor", "rg_do_menor",
+                "data_de_nascimento_do_menor", "endereço", "cep", "telefone", "email"
+            ]
             
-            self.extracted_data = data_extractor.get_data_from_text(
-                extracted_text,
-                GOOGLE_API_KEY
-            )
+            for field in all_fields:
+                if field not in self.extracted_data:
+                    self.extracted_data[field] = ""
             
-            # Step 6: Populate fields with extracted data
-            if self.extracted_data:
-                # Add missing fields with empty values
-                all_fields = [
-                    "nome_do_responsavel", "nome_do_menor", "nome_da_mae_do_menor",
-                    "cpf_do_responsavel", "rg_do_responsavel", "cpf_do_menor", "rg_do_menor",
-                    "data_de_nascimento_do_menor", "endereço", "cep", "telefone", "email"
-                ]
-                
-                for field in all_fields:
-                    if field not in self.extracted_data:
-                        self.extracted_data[field] = ""
-                
+            # Streamed values are already on screen and may have been edited by the operator
+            # meanwhile, and the fields that never arrived are empty anyway: leave the page as it is
+            if not streamed:
                 # Populate UI fields (except CIDs)
                 for key, value in self.extracted_data.items():
-                    if key in self.data_fields:
-                        field = self.data_fields[key]
-                        if isinstance(field, QDateEdit):
-                            # Parse date and set QDateEdit
-                            if value:
-                                try:
-                                    date_obj = QDate.fromString(str(value), "dd/MM/yyyy")
-                                    if date_obj.isValid():
-                                        field.setDate(date_obj)
-                                except:
-                                    pass
-                        else:
-                            field.setText(str(value) if value else "")
+                    if key != "cids":
+                        self._set_field_value(key, value)
                 
                 # Handle CIDs separately - check boxes based on extracted data
                 if "cids" in self.extracted_data and self.extracted_data["cids"]:
                     self._set_cid_checkboxes_from_text(self.extracted_data["cids"])
-                
-                # Success message
-                self.progress_bar.setVisible(False)
-                self.progress_label.setText("✓ Dados extraídos! Verifique e edite se necessário.")
-                self.progress_label.setStyleSheet("color: #27ae60; font-weight: bold;")
-                
-                # Trigger scroll check to enable button if needed
-                QTimer.singleShot(100, self._check_scroll_position)
-            else:
-                raise Exception("Não foi possível extrair dados estruturados do texto.")
-                
-        except Exception as e:
-            # Handle errors
-            self.progress_bar.setVisible(False)
-            self.progress_label.setText("✗ Erro na extração de dados")
-            self.progress_label.setStyleSheet("color: #e74c3c; font-weight: bold;")
             
-            QMessageBox.critical(
-                self,
-                "Erro na Extração",
-                f"Ocorreu um erro ao extrair os dados:\n\n{str(e)}\n\nPor favor, preencha os campos manualmente."
-            )
+            # Success message
+            self.progress_bar.setVisible(False)
+            self.progress_label.setText("✓ Dados extraídos! Verifique e edite se necessário.")
+            self.progress_label.setStyleSheet("color: #27ae60; font-weight: bold;")
             
-            # Fill with basic data
-            self.data_fields["nome_do_menor"].setText(beneficiary_name)
+            # Trigger scroll check to enable button if needed
+            QTimer.singleShot(100, self._check_scroll_position)
+        else:
+            raise Exception("Não foi possível extrair dados estruturados do texto.")
+    
+    def _on_extraction_failed(self, error):
+        """Report an extraction that failed and leave the fields to the operator.
+        
+        Args:
+            error (str): Error message
+        """
+        # Handle errors
+        self.progress_bar.setVisible(False)
+        self.progress_label.setText("✗ Erro na extração de dados")
+        self.progress_label.setStyleSheet("color: #e74c3c; font-weight: bold;")
+        
+        QMessageBox.critical(
+            self,
+            "Erro na Extração",
+            f"Ocorreu um erro ao extrair os dados:\n\n{error}\n\nPor favor, preencha os campos manualmente."
+        )
+        
+        # Fill with basic data
+        self.data_fields["nome_do_menor"].setText(self.name_input.text().strip())
+    
+    def _set_field_value(self, key, value):
+        """Show an extracted value in its data field (CIDs check their checkboxes).
+        
+        Args:
+            key (str): Data field key (e.g. 'cpf_do_menor')
+            value: Extracted value
+        """
+        if key == "cids":
+            if value:
+                self._set_cid_checkboxes_from_text(value)
+            return
+        
+        if key not in self.data_fields:
+            return
+        
+        field = self.data_fields[key]
+        if isinstance(field, QDateEdit):
+            # Parse date and set QDateEdit
+            if value:
+                try:
+                    date_obj = QDate.fromString(str(value), "dd/MM/yyyy")
+                    if date_obj.isValid():
+                        field.setDate(date_obj)
+                except:
+                    pass
+        else:
+            field.setText(str(value) if value else "")
+    
+    def _field_state(self, key):
+        """Get what a data field currently shows (QDate for dates, text otherwise)."""
+        field = self.data_fields[key]
+        return field.date() if isinstance(field, QDateEdit) else field.text()
+    
+    def _restore_field_state(self, key, state):
+        """Put back a state taken with _field_state."""
+        field = self.data_fields[key]
+        if isinstance(field, QDateEdit):
+            field.setDate(state)
+        else:
+            field.setText(state)
+    
+    def _start_streamed_fill(self):
+        """Remember the fields as they are before streaming, to tell the operator's edits from the AI's values."""
+        self._initial_field_states = {key: self._field_state(key) for key in self.data_fields}
+        self._streamed_field_states = dict(self._initial_field_states)
+        self._streamed_cid_keys = []
+    
+    def _set_streamed_field_value(self, key, value):
+        """Show a streamed value, unless the operator already edited that field.
+        
+        Args:
+            key (str): Data field key (e.g. 'cpf_do_menor')
+            value: Extracted value
+        """
+        if key == "cids":
+            self._streamed_cid_keys += self._set_cid_checkboxes_from_text(value)
+            return
+        
+        if key not in self.data_fields:
+            return
+        
+        # Changed since the AI last wrote it: edited by the operator
+        if self._field_state(key) != self._streamed_field_states[key]:
+            return
+        
+        self._set_field_value(key, value)
+        self._streamed_field_states[key] = self._field_state(key)
+    
+    def _discard_streamed_values(self):
+        """Undo the streamed values (fields edited by the operator are kept) and uncheck the CIDs they checked."""
+        for key, state in self._streamed_field_states.items():
+            if self._field_state(key) == state:
+                self._restore_field_state(key, self._initial_field_states[key])
+                self._streamed_field_states[key] = self._initial_field_states[key]
+        
+        for checkbox_key in self._streamed_cid_keys:
+            self.cid_checkboxes[checkbox_key].setChecked(False)
+        self._streamed_cid_keys = []
     
     def _set_cid_checkboxes_from_text(self, cids_list):
         """Check matching checkboxes based on a list of CIDs that are available in web forms.
         
         Args:
             cids_list (list): List of CID codes (e.g., ['10 F84.0', '11 6A02'])
+            
+        Returns:
+            list: Keys of the checkboxes that were checked by this call
         """
+        checked_keys = []
         if not cids_list:
-            return
+            return checked_keys
         
         # Use web_automation function to get valid CIDs
         valid_cid_options = web_automation.get_best_guess_cids(cids_list)
         
         if not valid_cid_options:
-            return
+            return checked_keys
         
         # Map CID_OPTIONS to checkbox keys
         # CID_OPTIONS format: "cid10_F84_0", "cid11_6A02_0"
@@ -1999,8 +2348,11 @@ class AutoPreenchedorUI(QMainWindow):
             else:
                 continue
             
-            if checkbox_key in self.cid_checkboxes:
+            if checkbox_key in self.cid_checkboxes and not self.cid_checkboxes[checkbox_key].isChecked():
                 self.cid_checkboxes[checkbox_key].setChecked(True)
+                checked_keys.append(checkbox_key)
+        
+        return checked_keys
 
     
     def get_selected_cids(self):
@@ -2037,6 +2389,9 @@ class AutoPreenchedorUI(QMainWindow):
 
 def main():
     """Run the UI application."""
+    # Needed so the PDF worker processes can start from the frozen (pyinstaller) executable
+    multiprocessing.freeze_support()
+    
     app = QApplication(sys.argv)
     
     # Set application style